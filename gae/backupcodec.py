@@ -0,0 +1,171 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Compact binary encoding of cache values, for backups.
+
+Layout of an encoded value:
+
+    4 bytes   magic (b"CGB1")
+    4 bytes   header length N (unsigned int, little endian)
+    N bytes   header (UTF-8-encoded JSON)
+    ...       payload: the buffers described in the header, back to back
+
+A `table.Table` is stored column by column: the index (ISO 8601 time
+strings) and string columns as JSON arrays, numeric columns as typed arrays
+(raw machine representation, see `array.array`). Each buffer is optionally
+compressed (zlib). That is compact, and is decoded w/o pandas. Uncompressed,
+it can be decoded straight from a memory-mapped file.
+
+This program is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import json
+import struct
+import sys
+import zlib
+from array import array
+
+from table import Table
+
+
+MAGIC = b"CGB1"
+_PREAMBLE = struct.Struct("<4sI")
+
+
+def encode(value, compress=True, meta=None):
+    """
+    Encode `value` (a byte sequence, or a `Table`) and return a byte
+    sequence.
+
+    `meta`: optional JSON-serializable object, stored in the header (see
+    `decode_meta()`).
+    """
+    if isinstance(value, bytes):
+        header = {"kind": "bytes"}
+        buffers = [value]
+    else:
+        header, buffers = _table_to_buffers(value)
+
+    header["meta"] = meta
+    header["byteorder"] = sys.byteorder
+    header["compression"] = "zlib" if compress else None
+    if compress:
+        buffers = [zlib.compress(b, 6) for b in buffers]
+    header["buflens"] = [len(b) for b in buffers]
+
+    headerbytes = json.dumps(header, separators=(",", ":")).encode("utf-8")
+    return b"".join([_PREAMBLE.pack(MAGIC, len(headerbytes)), headerbytes] + buffers)
+
+
+def decode(buf):
+    """
+    Decode the output of `encode()`. `buf` can be any object supporting the
+    buffer protocol (e.g. bytes, or mmap).
+    """
+    header, buffers = _split(buf)
+    kind = header["kind"]
+    if kind == "bytes":
+        return bytes(buffers[0])
+    # `dataframe`: the previous name of the same layout.
+    if kind in ("table", "dataframe"):
+        return _table_from_buffers(header, buffers)
+    raise ValueError(f"unexpected kind: {kind!r}")
+
+
+def decode_meta(buf):
+    """
+    Return the `meta` object stored by `encode()`, without decoding the
+    value itself.
+    """
+    header, _ = _read_header(memoryview(buf))
+    return header["meta"]
+
+
+def _read_header(view):
+    magic, headerlen = _PREAMBLE.unpack_from(view, 0)
+    if magic != MAGIC:
+        raise ValueError(f"unexpected magic: {magic!r}")
+
+    offset = _PREAMBLE.size
+    header = json.loads(bytes(view[offset : offset + headerlen]).decode("utf-8"))
+    return header, offset + headerlen
+
+
+def _split(buf):
+    view = memoryview(buf)
+    header, offset = _read_header(view)
+
+    buffers = []
+    for length in header["buflens"]:
+        b = view[offset : offset + length]
+        if header["compression"] == "zlib":
+            b = zlib.decompress(b)
+        buffers.append(b)
+        offset += length
+
+    return header, buffers
+
+
+def _table_to_buffers(table):
+    columns = []
+    buffers = [_strings_to_buffer(table.index)]
+    for name, values in table.columns.items():
+        if isinstance(values, array):
+            typecode = values.typecode
+            buffers.append(values.tobytes())
+        else:
+            typecode = None
+            buffers.append(_strings_to_buffer(values))
+        columns.append([name, typecode])
+
+    header = {"kind": "table", "index_name": table.index_name, "columns": columns}
+    return header, buffers
+
+
+def _table_from_buffers(header, buffers):
+    columns = {}
+    for (name, typecode), buf in zip(header["columns"], buffers[1:]):
+        if typecode is None:
+            columns[name] = _strings_from_buffer(buf)
+        else:
+            columns[name] = _array_from_buffer(typecode, buf, header["byteorder"])
+
+    return Table(
+        _strings_from_buffer(buffers[0]), columns, index_name=header["index_name"]
+    )
+
+
+def _array_from_buffer(typecode, buf, byteorder):
+    a = array(typecode)
+    a.frombytes(buf)
+    if byteorder != sys.byteorder:
+        a.byteswap()
+    return a
+
+
+def _strings_to_buffer(values):
+    return json.dumps([str(v) for v in values], ensure_ascii=False).encode("utf-8")
+
+
+def _strings_from_buffer(buf):
+    return json.loads(bytes(buf).decode("utf-8"))
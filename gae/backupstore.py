@@ -0,0 +1,234 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Durable storage for cache backups: a key-value store of records, i.e. of
+flat dictionaries with str, int, float or bytes values.
+
+    firestore   documents in a Firestore collection (production)
+    local       files in a local directory
+    memory      process memory (for testing and benchmarking)
+
+Use `from_config()` to create a store. Creating a store is cheap: e.g. the
+Firestore client is only created upon first use.
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import base64
+import json
+import logging
+import os
+import tempfile
+import threading
+
+
+log = logging.getLogger(__file__)
+
+
+class BackupStore:
+    """
+    Interface. Implementations must be thread-safe.
+    """
+
+    def get(self, key):
+        """
+        Return the record stored under `key`, or `None`.
+        """
+        raise NotImplementedError
+
+    def set(self, key, record):
+        """
+        Store `record` under `key`, replacing any previous record.
+        """
+        raise NotImplementedError
+
+    def update(self, key, fields):
+        """
+        Set `fields` (a dictionary) in the record stored under `key`, leaving
+        its other fields alone. Raise `KeyError` if there is no such record.
+        """
+        raise NotImplementedError
+
+    def delete(self, key):
+        """
+        Delete the record stored under `key`, if any.
+        """
+        raise NotImplementedError
+
+    def __str__(self):
+        return self.__class__.__name__
+
+
+class FirestoreBackupStore(BackupStore):
+    """
+    One Firestore document per record, in collection `collection`.
+    """
+
+    def __init__(self, collection="cache"):
+        self.collection_name = collection
+        self._collection = None
+        self._lock = threading.Lock()
+
+    def _coll(self):
+        if self._collection is None:
+            with self._lock:
+                if self._collection is None:
+                    # Import (and create the client) upon first use: both
+                    # are expensive, and need credentials.
+                    from google.cloud import firestore
+
+                    log.info("create firestore client")
+                    self._collection = firestore.Client().collection(
+                        self.collection_name
+                    )
+        return self._collection
+
+    def get(self, key):
+        # `to_dict()` returns `None` if the document does not exist.
+        return self._coll().document(key).get().to_dict()
+
+    def set(self, key, record):
+        self._coll().document(key).set(record)
+
+    def update(self, key, fields):
+        from google.api_core.exceptions import NotFound
+
+        # Does not transfer the (large) `data` field again.
+        try:
+            self._coll().document(key).update(fields)
+        except NotFound:
+            raise KeyError(key)
+
+    def delete(self, key):
+        self._coll().document(key).delete()
+
+
+class LocalBackupStore(BackupStore):
+    """
+    One file per record, in directory `path` (created if required).
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._made_dir = False
+        # Serializes `update()` (read-modify-write) with other writes.
+        self._lock = threading.Lock()
+
+    def _filepath(self, key):
+        return os.path.join(self.path, f"{key}.backup.json")
+
+    def get(self, key):
+        try:
+            with open(self._filepath(key), "rb") as f:
+                return json.loads(f.read().decode("utf-8"), object_hook=_decode_bytes)
+        except FileNotFoundError:
+            return None
+
+    def set(self, key, record):
+        with self._lock:
+            self._set(key, record)
+
+    def update(self, key, fields):
+        with self._lock:
+            record = self.get(key)
+            if record is None:
+                raise KeyError(key)
+            record.update(fields)
+            self._set(key, record)
+
+    def _set(self, key, record):
+        if not self._made_dir:
+            os.makedirs(self.path, exist_ok=True)
+            self._made_dir = True
+        data = json.dumps(record, default=_encode_bytes).encode("utf-8")
+        # Write to a temporary file in the same directory, then rename: a
+        # reader never sees a partially written record.
+        fd, tmppath = tempfile.mkstemp(dir=self.path, prefix=f".{key}-")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(data)
+            os.replace(tmppath, self._filepath(key))
+        except BaseException:
+            os.unlink(tmppath)
+            raise
+
+    def delete(self, key):
+        try:
+            os.unlink(self._filepath(key))
+        except FileNotFoundError:
+            pass
+
+
+class MemoryBackupStore(BackupStore):
+    """
+    Records live in the memory of the current process.
+    """
+
+    def __init__(self):
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            record = self._records.get(key)
+            return None if record is None else dict(record)
+
+    def set(self, key, record):
+        with self._lock:
+            self._records[key] = dict(record)
+
+    def update(self, key, fields):
+        with self._lock:
+            self._records[key].update(fields)
+
+    def delete(self, key):
+        with self._lock:
+            self._records.pop(key, None)
+
+
+def _encode_bytes(obj):
+    if isinstance(obj, bytes):
+        return {"__bytes_b64__": base64.b64encode(obj).decode("ascii")}
+    raise TypeError(f"cannot serialize {type(obj)}")
+
+
+def _decode_bytes(d):
+    if len(d) == 1 and "__bytes_b64__" in d:
+        return base64.b64decode(d["__bytes_b64__"])
+    return d
+
+
+def from_config(kind, local_path=None):
+    """
+    Return a new store of type `kind`: `firestore`, `local` or `memory`.
+    `local_path`: directory for the `local` store.
+    """
+    if kind == "firestore":
+        return FirestoreBackupStore()
+    if kind == "local":
+        if local_path is None:
+            local_path = os.path.join(tempfile.gettempdir(), "cache-backups")
+        return LocalBackupStore(local_path)
+    if kind == "memory":
+        return MemoryBackupStore()
+    raise ValueError(f"unknown backup store type: {kind}")
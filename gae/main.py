@@ -24,28 +24,66 @@
 This program is part of https://github.com/jgehrcke/covid-19-germany-gae
 """
 
+# Import first: marks the start of the startup timing report.
+import startup
+
 import os
 import logging
 import sys
 import re
 import io
 import tempfile
-import pickle
 import uuid
 import json
+import mmap
+import threading
+import hashlib
+import hmac
+import zlib
+import bisect
+import math
+import csv
+import importlib.util
+from array import array
+from collections import OrderedDict, namedtuple
 from textwrap import dedent
 from time import time
-from datetime import datetime
+from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor, wait
+
+startup.checkpoint("import stdlib modules")
+
+# Heavy, and not needed for serving from a warm cache (local snapshot):
+# import upon first use.
+pd = startup.LazyModule("pandas")
+pytz = startup.LazyModule("pytz")
+
+# The `arrow` output format is offered only if pyarrow is available.
+pyarrow = None
+if importlib.util.find_spec("pyarrow") is not None:
+    pyarrow = startup.LazyModule("pyarrow", submodules=["pyarrow.ipc"])
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
 
-import pandas as pd
-import requests
-import pytz
+startup.checkpoint("import brotli")
 
-from google.cloud import firestore
-import google.cloud.exceptions
-from flask import Flask, jsonify, abort, Response
+from flask import Flask, abort, Response
 import flask
 
+startup.checkpoint("import flask")
+
+import backupcodec
+import backupstore
+import metrics
+import sharedstate
+import upstream
+from table import Table
+
+startup.checkpoint("import app modules")
+
 app = Flask(__name__)
 
 app.config["JSONIFY_PRETTYPRINT_REGULAR"] = True
@@ -54,9 +92,53 @@ ZEIT_JSON_URL = os.environ["ZEIT_JSON_URL"]
 BE_MOPO_CSV_URL = os.environ["BE_MOPO_CSV_URL"]
 RL_TS_CSV_URL = os.environ["RL_TS_CSV_URL"]
 
-FIRESTORE = firestore.Client().collection("cache")
-FS_NOW_DOC = FIRESTORE.document("gernow-2")
-FS_TIMESERIES_DOC = FIRESTORE.document("gerhistory-2")
+# Base URL for reading data files of this repository. Can be pointed to a
+# local stand-in (see tools/bench).
+DATA_REPO_RAW_URL = os.environ.get(
+    "DATA_REPO_RAW_URL",
+    "https://raw.githubusercontent.com/jgehrcke/covid-19-germany-gae/master",
+)
+
+# Expected time between cache refreshes: the schedule of the update jobs in
+# cron.yaml. Used for deriving the Cache-Control header of responses.
+REFRESH_INTERVAL_SECONDS = 10 * 60
+
+# Total time budget (seconds, incl. retries) for fetching a document from
+# GitHub, and from each of the /now data sources. The latter must stay below
+# `CacheNow.fetch_deadline_seconds`: fail fast, serve the previous value.
+GITHUB_BUDGET_SECONDS = 60
+NOW_SOURCE_BUDGET_SECONDS = 20
+
+# Send a second (hedged) request to a /now data source if the first one
+# takes longer than this percentile of recent response times.
+NOW_SOURCE_HEDGE_PERCENTILE = 95
+
+# Directory for local cache snapshots (on GAE only /tmp is writable).
+SNAPSHOT_DIR = os.environ.get("CACHE_SNAPSHOT_DIR", tempfile.gettempdir())
+
+# Share cache refreshes across the uwsgi worker processes of this instance (see
+# sharedstate.py): `1`, `0`, or `auto` (default: if there is more than one).
+_cache_shared = os.environ.get("CACHE_SHARED", "auto")
+SHARED_CACHE = (
+    sharedstate.processes() > 1 if _cache_shared == "auto" else _cache_shared == "1"
+)
+
+# Where to keep cache backups: `firestore` (default), `local` (directory
+# BACKUP_STORE_DIR), or `memory`. See backupstore.py.
+BACKUP_STORE = backupstore.from_config(
+    os.environ.get("BACKUP_STORE", "firestore"),
+    local_path=os.environ.get("BACKUP_STORE_DIR"),
+)
+
+# Properties of each Landkreis / kreisfreie Stadt, keyed by Amtlicher
+# Gemeindeschluessel (AGS). gae/ags.json is a symlink to the file in the
+# repository root.
+with open(
+    os.path.join(os.path.dirname(os.path.abspath(__file__)), "ags.json"), "rb"
+) as f:
+    AGS_PROPERTY_DICT = json.loads(f.read().decode("utf-8"))
+
+startup.checkpoint("read ags.json")
 
 
 log = logging.getLogger()
@@ -67,6 +149,91 @@ logging.basicConfig(
 )
 
 
+METRIC_HTTP_REQUEST_SECONDS = metrics.Histogram(
+    "http_request_duration_seconds",
+    "Time spent handling an HTTP request, by route.",
+    ["route", "method"],
+)
+METRIC_HTTP_REQUESTS = metrics.Counter(
+    "http_requests_total",
+    "HTTP requests handled, by route and response status code.",
+    ["route", "method", "status"],
+)
+METRIC_UPSTREAM_SECONDS = metrics.Histogram(
+    "upstream_request_duration_seconds",
+    "Duration of HTTP requests to upstream data sources, by source.",
+    ["source"],
+)
+METRIC_UPSTREAM_FAILURES = metrics.Counter(
+    "upstream_request_failures_total",
+    "Failed fetches from upstream data sources (after retrying, or skipped).",
+    ["source"],
+)
+METRIC_CACHE_REFRESH_SECONDS = metrics.Histogram(
+    "cache_refresh_duration_seconds",
+    "Duration of cache refreshes, by outcome (updated, unchanged, failed).",
+    ["cache", "outcome"],
+)
+METRIC_CACHE_BACKUP_BYTES = metrics.Gauge(
+    "cache_backup_size_bytes", "Size of the most recent backup.", ["cache"]
+)
+METRIC_CACHE_BACKUP_SECONDS = metrics.Histogram(
+    "cache_backup_write_duration_seconds",
+    "Time spent writing a backup to the backup store.",
+    ["cache"],
+)
+METRIC_CACHE_AGE_AT_READ_SECONDS = metrics.Histogram(
+    "cache_age_at_read_seconds",
+    "Age of the cache value served, when read.",
+    ["cache"],
+    buckets=(10, 60, 300, 600, 900, 1800, 3600, 7200, 86400),
+)
+METRIC_STARTUP_PHASE_SECONDS = metrics.Gauge(
+    "startup_phase_duration_seconds",
+    "Duration of the phases of process startup, up to the first response.",
+    ["phase"],
+)
+
+
+@app.before_request
+def _before_request():
+    flask.g.request_start_time = time()
+
+
+@app.after_request
+def _after_request(response):
+    # Label by URL rule, not by path: bounded number of label values.
+    rule = flask.request.url_rule
+    route = rule.rule if rule is not None else "unmatched"
+    method = flask.request.method
+    METRIC_HTTP_REQUEST_SECONDS.observe(
+        time() - flask.g.request_start_time, route=route, method=method
+    )
+    METRIC_HTTP_REQUESTS.inc(route=route, method=method, status=response.status_code)
+
+    # Report where (cold) startup time went, once the first request is
+    # handled: that includes lazy imports and cache loading.
+    if not startup.reported:
+        first = [(f"first request ({route})", time() - flask.g.request_start_time)]
+        if startup.log_report_once(extra=first):
+            for phase, seconds in startup.phases() + first:
+                METRIC_STARTUP_PHASE_SECONDS.set(seconds, phase=phase)
+    return response
+
+
+@app.route("/metrics")
+def get_metrics():
+    # Internal: require `Authorization: Bearer <METRICS_AUTH_TOKEN>`.
+    token = os.environ.get("METRICS_AUTH_TOKEN")
+    # Compare bytes: `compare_digest()` raises TypeError for str containing
+    # non-ASCII characters.
+    auth = flask.request.headers.get("Authorization", "").encode("utf-8")
+    expected = f"Bearer {token}".encode("utf-8")
+    if not (app.debug or (token and hmac.compare_digest(auth, expected))):
+        abort(403, "go away")
+    return Response(metrics.render(), content_type=metrics.CONTENT_TYPE)
+
+
 @app.route("/_tasks/update_now")
 def task_update_now():
     if flask.request.headers.get("X-Appengine-Cron") or app.debug:
@@ -83,6 +250,53 @@ def task_update_timeseries():
     abort(403, "go away")
 
 
+@app.route("/_tasks/update_timeseries_ags")
+def task_update_timeseries_ags():
+    if flask.request.headers.get("X-Appengine-Cron") or app.debug:
+        CACHE_TIMESERIES_AGS.refresh()
+        return "Accepted, Sir", 202
+    abort(403, "go away")
+
+
+@app.route("/_tasks/update_7di")
+def task_update_7di():
+    if flask.request.headers.get("X-Appengine-Cron") or app.debug:
+        CACHE_7DI.refresh()
+        return "Accepted, Sir", 202
+    abort(403, "go away")
+
+
+@app.route("/_ah/warmup")
+def warmup():
+    # App Engine sends this request to a new instance before routing user
+    # traffic to it (see `inbound_services` in app.yaml). Cheap if warm.
+    # Only the uwsgi process handling this request gets warmed up. With more
+    # than one process the others load the value from the local snapshot
+    # written here (see sharedstate.py) upon their first read, and then
+    # prepare their own artifacts: cheaper than a cold start, but not free.
+    t0 = time()
+    caches = [CACHE_NOW, CACHE_TIMESERIES, CACHE_TIMESERIES_AGS, CACHE_7DI]
+    with ThreadPoolExecutor(
+        max_workers=len(caches) + 1, thread_name_prefix="warmup"
+    ) as executor:
+        futures = [executor.submit(startup.load_lazy_modules)]
+        futures.extend(executor.submit(c.warm_up) for c in caches)
+    for fut in futures:
+        try:
+            fut.result()
+        except Exception as err:
+            # Do not fail the warmup: `get()` tries again upon read.
+            log.exception("err during warmup: %s", err)
+
+    # Most county-level documents are only encoded upon request (see
+    # `AGSTimeseriesDocs`): encode the most-requested ones now.
+    if CACHE_TIMESERIES_AGS.current_value[1] is not None:
+        CACHE_TIMESERIES_AGS.current_value[1].preencode()
+
+    log.info("warmup took %.3f s", time() - t0)
+    return "Warm, Sir", 200
+
+
 @app.route("/")
 def rootpath():
     return 'For documentation see <a href="https://github.com/jgehrcke/covid-19-germany-gae">github.com/jgehrcke/covid-19-germany-gae</a>'
@@ -90,10 +304,8 @@ def rootpath():
 
 @app.route("/now")
 def germany_now():
-    # Cached value is JSON text, encoded into a byte sequences via.
-    r = Response(CACHE_NOW.get(), content_type="application/json; charset=utf-8")
-    r.headers.add("Access-Control-Allow-Origin", "*")
-    return r
+    # Cached value is an `Artifact`: JSON text, encoded into a byte sequence.
+    return _artifact_response(CACHE_NOW.get(), CACHE_NOW)
 
 
 STATE_WHITELIST = [
@@ -126,6 +338,16 @@ TIMESERIES_JSON_OUTPUT_META_DICT = {
 }
 
 
+@app.route("/timeseries/all")
+def get_timeseries_all():
+    # All columns of data.csv in one columnar document, pre-encoded once per
+    # refresh (in each output format).
+    docs = CACHE_TIMESERIES.get()
+    return _artifact_response(
+        docs.all[_output_format(docs.all)], CACHE_TIMESERIES, negotiated=True
+    )
+
+
 @app.route("/timeseries/<state>/<metric>")
 def get_timeseries(state, metric):
 
@@ -135,42 +357,468 @@ def get_timeseries(state, metric):
     if metric not in METRIC_WHITELIST:
         abort(400, f"Bad metric name. Must be one of: {', '.join(METRIC_WHITELIST)}")
 
-    df = CACHE_TIMESERIES.get()
+    docs = CACHE_TIMESERIES.get()
+    args = flask.request.args
+    fmt = _output_format(OUTPUT_FORMATS_AVAILABLE)
 
-    # Construct column name like DE-BW_c
-    column_name = state + METRIC_SUFFIX_MAP[metric]
-    output_dict = {
-        "data": [{time: value} for time, value in df[column_name].to_dict().items()],
-        "meta": TIMESERIES_JSON_OUTPUT_META_DICT,
-    }
-    resp = jsonify(output_dict)
-    resp.headers.add("Access-Control-Allow-Origin", "*")
+    if not any(k in args for k in ("since", "until", "last")):
+        # The entire time series. Pre-encoded once per refresh, only a dict
+        # lookup here.
+        return _artifact_response(
+            docs.full[(state, metric, fmt)], CACHE_TIMESERIES, negotiated=True
+        )
+
+    lo, hi = _row_range(docs.epochs)
+    return _artifact_response(
+        docs.slice(state, metric, lo, hi, fmt), CACHE_TIMESERIES, negotiated=True
+    )
+
+
+AGS_TIMESERIES_JSON_OUTPUT_META_DICT = {
+    "source": "Robert Koch-Institut (RKI), per-county data via the ArcGIS HTTP API of the Esri COVID-19 GeoHub Deutschland",
+    "info": "https://github.com/jgehrcke/covid-19-germany-gae",
+}
+
+
+@app.route("/timeseries/ags/<ags>/<metric>")
+def get_timeseries_ags(ags, metric):
+
+    if ags not in AGS_PROPERTY_DICT:
+        abort(400, "Bad AGS. Must be one of the keys in ags.json.")
+
+    if metric not in METRIC_WHITELIST:
+        abort(400, f"Bad metric name. Must be one of: {', '.join(METRIC_WHITELIST)}")
+
+    docs = CACHE_TIMESERIES_AGS.get()
+    fmt = _output_format(OUTPUT_FORMATS_AVAILABLE)
+    if any(k in flask.request.args for k in ("since", "until", "last")):
+        artifact = docs.slice(ags, metric, *_row_range(docs.epochs), fmt)
+    else:
+        artifact = docs.get(ags, metric, fmt)
+    if artifact is None:
+        abort(404, f"No data for AGS {ags}.")
+    return _artifact_response(artifact, CACHE_TIMESERIES_AGS, negotiated=True)
+
+
+SEVEN_DAY_INCIDENCE_JSON_OUTPUT_META_DICT = {
+    "source": "Derived from official RKI data: sum of newly confirmed cases within the last seven days, per 100.000 inhabitants",
+    "info": "https://github.com/jgehrcke/covid-19-germany-gae",
+}
+
+
+@app.route("/7di/germany")
+def get_7di_germany():
+    artifact = CACHE_7DI.get().get("germany")
+    if artifact is None:
+        abort(404, "No data for germany.")
+    return _artifact_response(artifact, CACHE_7DI)
+
+
+@app.route("/7di/<ags>")
+def get_7di(ags):
+
+    if ags not in AGS_PROPERTY_DICT:
+        abort(400, "Bad AGS. Must be one of the keys in ags.json, or 'germany'.")
+
+    artifact = CACHE_7DI.get().get(ags)
+    if artifact is None:
+        abort(404, f"No data for AGS {ags}.")
+    return _artifact_response(artifact, CACHE_7DI)
+
+
+def _row_range(epochs):
+    """
+    Return (lo, hi): the range of rows [lo, hi) selected by the query
+    parameters `since`, `until` and `last` (all rows by default), given
+    the sorted row timestamps `epochs`.
+    """
+    args = flask.request.args
+    lo, hi = 0, len(epochs)
+    if "since" in args:
+        since, _ = _parse_time_arg("since")
+        lo = bisect.bisect_left(epochs, since)
+    if "until" in args:
+        until, is_date = _parse_time_arg("until")
+        if is_date:
+            # Include the entire day.
+            hi = bisect.bisect_left(epochs, until + 86400)
+        else:
+            hi = bisect.bisect_right(epochs, until)
+    if "last" in args:
+        try:
+            last = int(args["last"])
+            if last < 0:
+                raise ValueError
+        except ValueError:
+            abort(400, "Bad value for last. Must be a non-negative integer.")
+        lo = max(lo, hi - last)
+    return lo, hi
+
+
+def _parse_time_arg(name):
+    """
+    Parse query parameter `name` as ISO 8601 date or datetime (UTC if no
+    offset is given). Return 2-tuple: Unix timestamp, and a boolean
+    indicating whether the value was a date (w/o time of day).
+    """
+    value = flask.request.args[name]
+    try:
+        # `fromisoformat()` does not accept the Z suffix (before Py 3.11).
+        dt = datetime.fromisoformat(re.sub(r"Z$", "+00:00", value))
+    except ValueError:
+        abort(400, f"Bad value for {name}. Must be ISO 8601 date or datetime.")
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt.timestamp(), len(value) == len("YYYY-MM-DD")
+
+
+class Artifact:
+    """
+    A pre-encoded response body, plus metadata derived from it. Typically
+    built once per cache refresh, not in the request path (but see `fast`).
+    Treat as immutable.
+
+    Next to the original body (`identity` encoding) this also holds
+    compressed variants, keyed by content-coding name (as used in the
+    Accept-Encoding and Content-Encoding headers).
+    """
+
+    __slots__ = ("body", "content_type", "etag", "variants")
+
+    # Do not bother compressing tiny bodies: the framing overhead eats most
+    # of the gain.
+    compress_min_bytes = 256
+
+    # Preparing artifacts is on the warm-start path (restoring from snapshot
+    # or backup), too. Brotli's highest quality levels are ~50x slower than
+    # level 5, for ~20 % smaller output.
+    brotli_quality = 5
+
+    # For artifacts built in the request path (`fast`): ~30x faster than the
+    # levels above, for ~15-25 % larger output.
+    fast_brotli_quality = 1
+    fast_gzip_level = 1
+
+    def __init__(
+        self,
+        body,
+        content_type="application/json",
+        etag=None,
+        compress=True,
+        fast=False,
+    ):
+        self.body = body
+        self.content_type = content_type
+        # Content hash, used as strong entity tag: changes if and only if the
+        # byte sequence changes. Can be provided by the caller if it has a
+        # cheaper way of uniquely identifying the content.
+        self.etag = etag or hashlib.sha1(body).hexdigest()
+
+        # Map content-coding to (body, etag) tuple. Each variant is a
+        # different representation, i.e. needs its own strong entity tag.
+        # Insertion order expresses server-side preference.
+        self.variants = {}
+        if compress and len(body) >= self.compress_min_bytes:
+            quality = self.fast_brotli_quality if fast else self.brotli_quality
+            level = self.fast_gzip_level if fast else 9
+            if brotli is not None:
+                self.variants["br"] = (
+                    brotli.compress(body, quality=quality),
+                    self.etag + "-br",
+                )
+            self.variants["gzip"] = (_gzip_compress(body, level), self.etag + "-gz")
+        self.variants["identity"] = (body, self.etag)
+
+
+def _gzip_compress(data, level=9):
+    # Use zlib directly for a deterministic result (gzip header w/o mtime).
+    # By default spend CPU on the highest compression level: this happens
+    # once per refresh, not once per response.
+    c = zlib.compressobj(level, zlib.DEFLATED, 31)
+    return c.compress(data) + c.flush()
+
+
+def _artifact_response(artifact, cache, negotiated=False):
+    """
+    Build the response for `artifact`, in the content-coding preferred by the
+    client. Answer a conditional GET request with a bodyless 304 response
+    when the client already has the current version.
+
+    Allow shared caches (proxies, the GAE edge) and clients to re-use the
+    response until the next expected refresh of `cache` (the `Cache` the
+    artifact is from), and to serve it stale while revalidating for another
+    refresh interval.
+
+    Set `negotiated` if `artifact` has been selected based on the Accept
+    header (see `_output_format()`).
+    """
+    encoding = flask.request.accept_encodings.best_match(
+        artifact.variants, default="identity"
+    )
+    body, etag = artifact.variants[encoding]
+
+    if flask.request.if_none_match.contains_weak(etag):
+        r = Response(status=304)
+        # No representation, no media type.
+        r.headers.remove("Content-Type")
+    else:
+        r = Response(body, content_type=artifact.content_type)
+        if encoding != "identity":
+            r.headers["Content-Encoding"] = encoding
+
+    r.set_etag(etag)
+    r.headers["Vary"] = "Accept, Accept-Encoding" if negotiated else "Accept-Encoding"
+    r.headers.add("Access-Control-Allow-Origin", "*")
+
+    # Seconds until the next refresh is due (0 if overdue: revalidate).
+    now = time()
+    next_refresh = cache.current_value[0] + REFRESH_INTERVAL_SECONDS
+    max_age = int(min(max(next_refresh - now, 0), REFRESH_INTERVAL_SECONDS))
+    r.headers["Cache-Control"] = (
+        f"public, max-age={max_age}, "
+        f"stale-while-revalidate={REFRESH_INTERVAL_SECONDS}"
+    )
+    r.expires = now + max_age
+    return r
+
+
+def _json_bytes_pretty(obj):
+    """
+    Serialize `obj` into UTF-8-encoded JSON text, byte-identical to what
+    Flask's `jsonify()` emits with JSONIFY_PRETTYPRINT_REGULAR enabled.
+    """
+    text = json.dumps(obj, indent=2, separators=(", ", ": "), sort_keys=True)
+    return (text + "\n").encode("utf-8")
+
+
+def _json_bytes_compact(obj):
+    """
+    Serialize `obj` into UTF-8-encoded JSON text, w/o any insignificant
+    whitespace.
+    """
+    return json.dumps(obj, separators=(",", ":")).encode("utf-8")
+
+
+# Output formats for the time series endpoints. Map name (as used in the
+# `format` query parameter) to media type. The first one is the default.
+OUTPUT_FORMATS = OrderedDict(
+    [
+        ("json", "application/json"),
+        ("json-compact", "application/json"),
+        ("csv", "text/csv; charset=utf-8"),
+        ("ndjson", "application/x-ndjson"),
+        ("arrow", "application/vnd.apache.arrow.stream"),
+    ]
+)
+
+OUTPUT_FORMATS_AVAILABLE = [f for f in OUTPUT_FORMATS if f != "arrow" or pyarrow]
+
+
+def _output_format(available):
+    """
+    Return the name of the output format requested by the client, out of
+    `available`: via the `format` query parameter or else via the Accept
+    header. Fall back to the first one (JSON): this is what clients got
+    before there was a choice.
+    """
+    fmt = flask.request.args.get("format")
+    if fmt is not None:
+        if fmt not in available:
+            abort(400, f"Bad format. Must be one of: {', '.join(available)}")
+        return fmt
+
+    # Map media type to format name. Pretty-printed JSON wins over compact
+    # JSON: same media type, and the former is the historical default.
+    offers = OrderedDict()
+    for name in available:
+        offers.setdefault(OUTPUT_FORMATS[name].split(";")[0], name)
+    best = flask.request.accept_mimetypes.best_match(list(offers))
+    return offers.get(best, next(iter(available)))
+
+
+# Layout of a document made of rows: `head`, rows joined by `sep`, `tail`.
+# `empty`, if set, is the document for zero rows.
+_RowLayout = namedtuple("_RowLayout", ["head", "sep", "tail", "empty"])
+
+
+def _encode_series_rows(fmt, timestrings, values, value_name, meta):
+    """
+    Encode a time series in text output format `fmt`, as one byte sequence
+    per data point. Return (layout, rows): any contiguous range of rows can
+    be assembled into a valid document (`_assemble_rows()`) w/o encoding
+    anything.
+
+    The JSON formats emit the historical document structure (`data` array of
+    single-key objects, plus `meta`). NDJSON emits one such object per line.
+    """
+    timekeys = [json.dumps(t) for t in timestrings]
+    valuestrs = [json.dumps(v) for v in values]
+
+    if fmt == "json":
+        # Produce the exact same format as `_json_bytes_pretty()`: cut the
+        # document for a one-element series apart.
+        head, tail = _json_bytes_pretty({"data": [None], "meta": meta}).split(b"null")
+        empty = _json_bytes_pretty({"data": [], "meta": meta})
+        layout = _RowLayout(head, b", \n    ", tail, empty)
+        rowfmt = "{{\n      {}: {}\n    }}"
+    elif fmt == "json-compact":
+        head, tail = _json_bytes_compact({"data": [None], "meta": meta}).split(b"null")
+        layout = _RowLayout(head, b",", tail, None)
+        rowfmt = "{{{}:{}}}"
+    elif fmt == "ndjson":
+        layout = _RowLayout(b"", b"", b"", None)
+        rowfmt = "{{{}:{}}}\n"
+    elif fmt == "csv":
+        layout = _RowLayout(
+            f"time_iso8601,{value_name}\n".encode("utf-8"), b"", b"", None
+        )
+        timekeys = timestrings
+        rowfmt = "{},{}\n"
+    else:
+        raise ValueError(f"not a text output format: {fmt}")
+
+    rows = [rowfmt.format(k, v).encode("utf-8") for k, v in zip(timekeys, valuestrs)]
+    return layout, rows
+
+
+def _assemble_rows(layout, rows, lo, hi):
+    if lo >= hi and layout.empty is not None:
+        return layout.empty
+    return b"".join((layout.head, layout.sep.join(rows[lo:hi]), layout.tail))
+
+
+def _csv_bytes(header, rows):
+    """
+    Encode CSV document (UTF-8), w/o index column.
+    """
+    buf = io.StringIO()
+    writer = csv.writer(buf, lineterminator="\n")
+    writer.writerow(header)
+    writer.writerows(rows)
+    return buf.getvalue().encode("utf-8")
+
+
+def _arrow_ipc_bytes(table):
+    """
+    Serialize pyarrow table into the Arrow IPC streaming format.
+    """
+    sink = pyarrow.BufferOutputStream()
+    with pyarrow.ipc.new_stream(sink, table.schema) as writer:
+        writer.write_table(table)
+    return sink.getvalue().to_pybytes()
+
+
+def _arrow_time_array(epochs):
+    return pyarrow.array(
+        [int(e) for e in epochs], type=pyarrow.timestamp("s", tz="UTC")
+    )
+
+
+def _upstream_get(source, url, **kwargs):
+    """
+    `upstream.fetch()` (retrying, circuit breaker per `source`), instrumented:
+    observe duration and count failures (after retrying, or fail-fast because
+    the source is considered down) per upstream `source`.
+    """
+    t0 = time()
+    try:
+        resp = upstream.fetch(url, source=source, **kwargs)
+    except Exception:
+        METRIC_UPSTREAM_FAILURES.inc(source=source)
+        raise
+    finally:
+        METRIC_UPSTREAM_SECONDS.observe(time() - t0, source=source)
     return resp
 
 
+# Sentinel, can be returned by `Cache.fetch_func()` implementations.
+UNCHANGED = object()
+
+
+def _validators_from_response(resp):
+    """
+    Return the validators (ETag, Last-Modified) from response `resp`.
+    """
+    return {k: resp.headers[k] for k in ("etag", "last-modified") if k in resp.headers}
+
+
+def _conditional_request_headers(validators):
+    """
+    Return request headers for a conditional request, given the validators of
+    a previous response (see `_validators_from_response()`).
+    """
+    headers = {}
+    if "etag" in validators:
+        headers["If-None-Match"] = validators["etag"]
+    if "last-modified" in validators:
+        headers["If-Modified-Since"] = validators["last-modified"]
+    return headers
+
+
 class Cache:
     """
     This cache is special in that it is not invalidated. It is only refreshed
     explicitly, and read. A warning/error is emitted when it it stale upon
-    reading.
+    reading. In stale-while-revalidate mode a stale read also triggers a
+    refresh in the background (or in the request path, if the value is
+    really old).
 
     The read path is simple, and does not include transient error paths.
 
-    The write path is complex, but is never part of processing consumer HTTP
-    requests. The write path is triggered only by GAE cron jobs.
+    The write path is complex. It is mainly triggered by GAE cron jobs, but
+    also by reads: in the request path if there is no value yet or if it is
+    really old, and in a background thread (stale-while-revalidate).
+    Refreshes of a cache never run concurrently (see `refresh()`).
 
     If a fresh instance of this app comes up and neither has a local file
     system cache entry nor can it consult the external sources (for which ever
-    rare reason) then fall back to using the last known good state in
-    Firestore.
+    rare reason) then fall back to using the last known good state in the
+    backup store (Firestore, in production).
+
+    The local file system cache entry (snapshot) is written upon each
+    successful refresh, and read first when the process has no value yet
+    (e.g. after a uwsgi worker recycle).
     """
 
-    def __init__(self, name, fbdoc):
+    def __init__(
+        self,
+        name,
+        backup_store,
+        backup_key,
+        stale_while_revalidate=True,
+        hardmax_age_seconds=60 * 60,
+    ):
         # Warn when the entry is older than that upon reading
         self.maxage_seconds = 15 * 60
-        self.fbdoc = fbdoc
-
-        self.picklekey = f"{name}.pickle"
+        self.backup_store = backup_store
+        self.backup_key = backup_key
+
+        # Firestore limits the size of a document to 1 MiB. Split larger
+        # backups across documents.
+        self.backup_chunk_bytes = 1000 * 1000
+
+        # Stale-while-revalidate mode: when reading an entry older than
+        # `maxage_seconds` serve it anyway, and trigger a refresh in a
+        # background thread (at most one at any given time, and not more
+        # often than every `revalidate_min_interval_seconds`). Entries older
+        # than `hardmax_age_seconds` are refreshed synchronously (in the
+        # request path), before being served.
+        self.stale_while_revalidate = stale_while_revalidate
+        self.hardmax_age_seconds = hardmax_age_seconds
+        self.revalidate_min_interval_seconds = 60
+        self._last_refresh_attempt_time = 0
+        self._bg_refresh_thread = None
+
+        self.name = name
+
+        # Content hash and chunk count of the last backup written to (or
+        # read from) the backup store. Used for skipping writes of unchanged data.
+        self._last_backup_digest = None
+        self._last_backup_nchunks = 0
+
+        # Value time of the local snapshot written (or read) last. Identifies
+        # the snapshot in the confirmation file (see `_write_snapshot_time()`).
+        self._snapshot_time = None
 
         # The currenly held value: None: not initialized. 2-tuple: first item
         # time, second item payload Remember: tuple is immutalbe (atomic
@@ -181,97 +829,1135 @@ class Cache:
         # corrupted view.
         self.current_value = (None, None)
 
+        # Single-flight state for refreshing in the request path: the first
+        # reader performs the refresh, concurrent readers wait for its outcome
+        # (for up to `inflight_wait_seconds`; if there's no value by then they
+        # fall back to the backup). `_inflight_done` is the
+        # `threading.Event` of the refresh in flight, if any.
+        self.inflight_wait_seconds = 30
+        self._inflight_lock = threading.Lock()
+        self._inflight_done = None
+
+        # Held for the duration of `refresh()`.
+        self._refresh_lock = threading.Lock()
+
+        # Multi-process mode (see sharedstate.py): one process refreshes
+        # (and writes the local snapshot), the others load the new value from
+        # the snapshot, and prepare it themselves (shared refresh, not shared
+        # memory). `_generation`: the shared generation of the current value.
+        self.shared = None
+        if SHARED_CACHE:
+            self.shared = sharedstate.SharedState(
+                os.path.join(SNAPSHOT_DIR, f"cache-{self.name}.shared")
+            )
+        self._generation = 0
+        self._sync_lock = threading.Lock()
+
+    def _prepare(self, value):
+        """
+        Turn a freshly fetched (or restored-from-backup) value into what is
+        going to be handed out by `get()`. The (potentially expensive)
+        transformation happens once per refresh, i.e. never in the request
+        path. The raw value (not the prepared one) is what gets backed up.
+        """
+        return value
+
     def get(self):
 
+        if self.shared is not None:
+            self._sync_from_shared()
+
         (valtime, val) = self.current_value
 
         if val is None:
             # During app init this code path can be entered by more than one
-            # thread. Could be optimized, but does not lead to incorrect
-            # behavior: we let more than one racer start, and all of the racers
-            # will try setting the initial value. The slowest one wins (that's
-            # not how things are in real life, right?).
-            log.info("%s: not yet set, _refresh()", self)
-            self.refresh()
-
-            # `refresh()` above either errors out or has the guaranteed side
-            # effect of leaving behind a `current_value`.
+            # thread.
+            log.info("%s: not yet set", self)
+            self._refresh_single_flight(valtime)
+
+            # `_refresh_single_flight()` above either errors out or has the
+            # guaranteed side effect of leaving behind a `current_value`.
             (valtime, val) = self.current_value
 
         age_seconds = time() - valtime
+        METRIC_CACHE_AGE_AT_READ_SECONDS.observe(age_seconds, cache=self.name)
         if age_seconds > self.maxage_seconds:
             log.warning("%s cache is stale: %s s", self, age_seconds)
 
+            if not self.stale_while_revalidate:
+                return val
+
+            if age_seconds > self.hardmax_age_seconds:
+                log.info("%s: exceeds hard max age, refresh synchronously", self)
+                self._refresh_single_flight(valtime, rate_limited=True)
+                (valtime, val) = self.current_value
+            else:
+                self._trigger_background_refresh()
+
         return val
 
-    def _set_value_from_firestore_backup(self):
-        log.info("%s: falling back to fetching firestore state", self)
-        old_backup_dict = self.fbdoc.get().to_dict()
-        log.info(old_backup_dict)
-        backup_value = pickle.loads(old_backup_dict[self.picklekey])
-        backup_time = old_backup_dict["time"]
+    def _sync_from_shared(self, blocking=False):
+        """
+        Adopt the value set by another process (i.e. load the local
+        snapshot), or its confirmation that the current value is fresh.
+
+        `blocking`: if another thread is loading the snapshot, wait for it
+        (instead of returning right away).
+        """
+        generation, valtime = self.shared.read()
+        if generation == self._generation:
+            current = self.current_value
+            if current[1] is not None and valtime > current[0]:
+                self.current_value = (valtime, current[1])
+            return
+
+        # Another thread is on it: serve the current value in the meantime.
+        if not self._sync_lock.acquire(blocking=blocking):
+            return
+        try:
+            if generation != self._generation:
+                log.info("%s: new value from another process", self)
+                self._set_value_from_snapshot()
+                # Also upon failure: do not retry for every read.
+                self._generation = generation
+        finally:
+            self._sync_lock.release()
+
+    def _may_refresh_now(self):
+        # Do not re-attempt refreshing too often (in the request path, or in
+        # the background) when the upstream sources are in trouble.
+        since = time() - self._last_refresh_attempt_time
+        return since > self.revalidate_min_interval_seconds
+
+    def _trigger_background_refresh(self):
+        with self._inflight_lock:
+            t = self._bg_refresh_thread
+            if t is not None and t.is_alive():
+                return
+            if self._inflight_done is not None or not self._may_refresh_now():
+                return
+            t = threading.Thread(
+                target=self.refresh, name=f"{self}-revalidate", daemon=True
+            )
+            self._bg_refresh_thread = t
+
+        log.info("%s: serve stale value, refresh in background", self)
+        t.start()
+
+    def warm_up(self):
+        """
+        Set a value if there is none yet, from the fastest tier that has one:
+        local snapshot, backup store, upstream. Unlike `get()` this prefers a
+        (possibly stale) backup over refreshing: stale-while-revalidate
+        takes care of that upon read. Unless the value is older than
+        `hardmax_age_seconds`: then the first read would refresh
+        synchronously, so refresh here instead.
+        """
+        if self.shared is not None:
+            self._sync_from_shared()
+        (valtime, val) = self.current_value
+        if val is None:
+            self._refresh_single_flight(valtime, prefer_backup=True)
+            (valtime, val) = self.current_value
+
+        age_seconds = time() - valtime
+        if age_seconds > self.hardmax_age_seconds:
+            log.info("%s: warm-up value too old (%s s), refresh", self, age_seconds)
+            self._refresh_single_flight(valtime)
+
+    def _refresh_single_flight(
+        self, seen_valtime, rate_limited=False, prefer_backup=False
+    ):
+        """
+        Only one thread (the leader) runs `refresh()`. Threads arriving while
+        that is in flight wait for it to complete, instead of hammering the
+        upstream sources (and the backup store) in parallel.
+
+        `seen_valtime`: the value time the caller has seen. Do nothing if the
+        value has been replaced since then.
+
+        `rate_limited`: do not start a new refresh if the last attempt was
+        too recent (do wait for one that is in flight, though).
+
+        `prefer_backup`: if there is no local snapshot, try the backup store
+        before refreshing.
+        """
+        with self._inflight_lock:
+            if self.current_value[0] != seen_valtime:
+                return
+            done = self._inflight_done
+            leader = done is None
+            if leader and rate_limited and not self._may_refresh_now():
+                return
+            if leader:
+                done = self._inflight_done = threading.Event()
+
+        if leader:
+            try:
+                if self.current_value[1] is None and self._set_value_from_snapshot():
+                    return
+                if prefer_backup and self.current_value[1] is None:
+                    try:
+                        self._set_value_from_backup()
+                        return
+                    except Exception as err:
+                        log.info("%s: no value from backup: %s", self, err)
+                self.refresh()
+            finally:
+                with self._inflight_lock:
+                    self._inflight_done = None
+                done.set()
+            return
+
+        log.info("%s: wait for in-flight refresh()", self)
+        if not done.wait(self.inflight_wait_seconds):
+            log.warning(
+                "%s: in-flight refresh() did not complete within %s s",
+                self,
+                self.inflight_wait_seconds,
+            )
+
+        if self.current_value[1] is None:
+            # The leader has failed, or is taking too long.
+            self._set_value_from_backup()
+
+    def _set_value_from_backup(self):
+        log.info("%s: falling back to fetching state from %s", self, self.backup_store)
+        backup = self.backup_store.get(self.backup_key)
+        if backup is None:
+            raise Exception(f"{self}: no backup in {self.backup_store}")
+        log.info(
+            "%s: backup meta data: %s",
+            self,
+            {k: v for k, v in backup.items() if k != "data"},
+        )
+
+        # Additional chunks (if any) live in separate documents.
+        chunks = [backup["data"]]
+        for i in range(1, backup["nchunks"]):
+            chunk = self.backup_store.get(self._backup_chunk_key(backup["digest"], i))
+            chunks.append(chunk["data"])
+        blob = b"".join(chunks)
+
+        if hashlib.sha1(blob).hexdigest() != backup["digest"]:
+            raise Exception(f"{self}: backup data does not match its digest")
+
+        backup_value = backupcodec.decode(blob)
+        backup_time = backup["time"]
         age_seconds = time() - backup_time
-        log.info("%s: got value from firestore (age: %s s", self, age_seconds)
+        log.info("%s: got value from backup (age: %s s)", self, age_seconds)
 
         # Atomically set what we've got.
-        self.current_value = (backup_time, backup_value)
+        self.current_value = (backup_time, self._prepare(backup_value))
+        self._last_backup_digest = backup["digest"]
+        self._write_snapshot(backup_time, backup_value)
+        self._last_backup_nchunks = backup["nchunks"]
+
+    def _snapshot_path(self):
+        return os.path.join(SNAPSHOT_DIR, f"cache-{self.name}.snapshot")
+
+    def _snapshot_time_path(self):
+        return os.path.join(SNAPSHOT_DIR, f"cache-{self.name}.snapshot-time")
+
+    def _read_snapshot_time(self, snaptime):
+        """
+        Return the time the snapshot with value time `snaptime` was last
+        confirmed to be fresh, or `snaptime`.
+        """
+        try:
+            with open(self._snapshot_time_path(), "rb") as f:
+                confirmation = json.loads(f.read())
+        except FileNotFoundError:
+            return snaptime
+        except Exception as err:
+            log.info("%s: err reading snapshot time: %s", self, err)
+            return snaptime
+        # Ignore confirmations of a previous snapshot.
+        if confirmation.get("time") != snaptime:
+            return snaptime
+        return max(snaptime, confirmation["confirmed"])
+
+    def _set_value_from_snapshot(self):
+        """
+        Set the value from the local snapshot. Return `True` upon success.
+        """
+        path = self._snapshot_path()
+        # Read before the snapshot: a newer snapshot is picked up later.
+        generation = self.shared.read()[0] if self.shared is not None else 0
+        try:
+            with open(path, "rb") as f:
+                with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as m:
+                    snaptime = backupcodec.decode_meta(m)["time"]
+                    value = backupcodec.decode(m)
+        except FileNotFoundError:
+            log.info("%s: no local snapshot at %s", self, path)
+            return False
+        except Exception as err:
+            log.exception("%s: err reading local snapshot: %s", self, err)
+            return False
 
-    def refresh(self):
+        self._snapshot_time = snaptime
+        valtime = self._read_snapshot_time(snaptime)
+        age_seconds = time() - valtime
+        log.info("%s: got value from local snapshot (age: %s s)", self, age_seconds)
+
+        # Atomically set what we've got.
+        self.current_value = (valtime, self._prepare(value))
+        self._generation = generation
+        return True
+
+    def _write_snapshot(self, valtime, value):
+        # Store uncompressed: allows for decoding from the mmapped file w/o
+        # another copy. Write to a temporary file in the same directory
+        # first, and then atomically rename it: readers never see a partial
+        # file.
+        blob = backupcodec.encode(value, compress=False, meta={"time": valtime})
+        fd, tmppath = tempfile.mkstemp(dir=SNAPSHOT_DIR, prefix=f".cache-{self.name}")
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmppath, self._snapshot_path())
+        except Exception as err:
+            log.exception("%s: err writing local snapshot: %s", self, err)
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+            return
+        self._snapshot_time = valtime
+        log.info("%s: wrote local snapshot, %s bytes", self, len(blob))
+
+    def _write_snapshot_time(self, confirmed):
+        """
+        Record that the value in the local snapshot was confirmed to be fresh
+        at time `confirmed`, w/o rewriting the snapshot: a restarted process
+        then does not consider that value to be older than it is.
+        """
+        if self._snapshot_time is None:
+            return
+        confirmation = {"time": self._snapshot_time, "confirmed": confirmed}
+        blob = json.dumps(confirmation).encode("utf-8")
+        fd, tmppath = tempfile.mkstemp(
+            dir=SNAPSHOT_DIR, prefix=f".cache-{self.name}-time"
+        )
+        try:
+            with os.fdopen(fd, "wb") as f:
+                f.write(blob)
+            os.replace(tmppath, self._snapshot_time_path())
+        except Exception as err:
+            log.exception("%s: err writing snapshot time: %s", self, err)
+            try:
+                os.unlink(tmppath)
+            except OSError:
+                pass
+
+    def _backup_chunk_key(self, digest, i):
+        # Name additional chunk records after the content hash. That way a
+        # (consistent) set of chunks is only ever referred to by the main
+        # record after all of them have been written.
+        return f"{self.backup_key}-{digest[:16]}-{i}"
+
+    def _read_backup_meta(self):
+        """
+        Learn about the current backup in the store (written by another
+        process, e.g. before a restart of this app): its chunks need to be
+        cleaned up when it gets replaced.
+        """
+        try:
+            backup = self.backup_store.get(self.backup_key)
+        except Exception as err:
+            log.info("%s: err reading current backup: %s", self, err)
+            return
+        if backup is not None and "digest" in backup:
+            self._last_backup_digest = backup["digest"]
+            self._last_backup_nchunks = backup.get("nchunks", 1)
+
+    def _write_backup(self, curtime, value):
+        blob = backupcodec.encode(value)
+        digest = hashlib.sha1(blob).hexdigest()
+        METRIC_CACHE_BACKUP_BYTES.set(len(blob), cache=self.name)
+        if self._last_backup_digest is None:
+            self._read_backup_meta()
+        if digest == self._last_backup_digest:
+            # Only record that the backed up data is still current: a process
+            # restoring from the backup must not consider it to be older than
+            # it is.
+            log.info("%s: data unchanged, only update backup time", self)
+            try:
+                self.backup_store.update(self.backup_key, {"time": curtime})
+            except KeyError:
+                # Deleted in the meantime: write the complete backup.
+                self._last_backup_digest = None
+            else:
+                return
+
+        n = self.backup_chunk_bytes
+        chunks = [blob[i : i + n] for i in range(0, len(blob), n)]
+        log.info(
+            "%s: write backup to %s, %s bytes, %s chunk(s)",
+            self,
+            self.backup_store,
+            len(blob),
+            len(chunks),
+        )
+
+        # Write additional chunks first, then the main record (which is
+        # what makes this backup current).
+        with METRIC_CACHE_BACKUP_SECONDS.time(cache=self.name):
+            for i, chunk in enumerate(chunks[1:], 1):
+                self.backup_store.set(
+                    self._backup_chunk_key(digest, i), {"data": chunk}
+                )
+            self.backup_store.set(
+                self.backup_key,
+                {
+                    "time": curtime,
+                    "codec": backupcodec.MAGIC.decode("ascii"),
+                    "digest": digest,
+                    "nchunks": len(chunks),
+                    "data": chunks[0],
+                },
+            )
 
+        # Clean up chunk records of the previous backup, if any.
+        if self._last_backup_digest is not None:
+            for i in range(1, self._last_backup_nchunks):
+                try:
+                    self.backup_store.delete(
+                        self._backup_chunk_key(self._last_backup_digest, i)
+                    )
+                except Exception as err:
+                    log.info("%s: err during chunk cleanup: %s", self, err)
+
+        self._last_backup_digest = digest
+        self._last_backup_nchunks = len(chunks)
+
+    def refresh(self):
+        # Serialize refreshes (cron job, background revalidation, request
+        # path): `fetch_func()` implementations keep state across calls, and
+        # an older fetch must not overwrite the value of a newer one.
+        with self._refresh_lock:
+            t0 = time()
+            outcome = "failed"
+            try:
+                if self.shared is None:
+                    outcome = self._refresh()
+                else:
+                    outcome = self._refresh_shared()
+            finally:
+                METRIC_CACHE_REFRESH_SECONDS.observe(
+                    time() - t0, cache=self.name, outcome=outcome
+                )
+
+    def _refresh_shared(self):
+        """
+        `_refresh()`, serialized across processes. If another process has
+        completed a refresh while waiting for the lock, adopt its value
+        instead of refreshing again.
+        """
+        seen = self.shared.read()
+        with self.shared.lock(self.inflight_wait_seconds) as acquired:
+            if not acquired:
+                log.warning(
+                    "%s: another process has been refreshing for more than %s s",
+                    self,
+                    self.inflight_wait_seconds,
+                )
+                if self.current_value[1] is None:
+                    self._set_value_from_backup()
+                return "failed"
+
+            if self.shared.read() != seen:
+                log.info("%s: refreshed by another process", self)
+                self._sync_from_shared(blocking=True)
+                if self.current_value[1] is None:
+                    # Could not load the snapshot. Leave a value behind, or
+                    # raise (see `_refresh_single_flight()`).
+                    self._set_value_from_backup()
+                    return "failed"
+                return "unchanged"
+
+            before = self.current_value
+            outcome = self._refresh()
+            after = self.current_value
+            # Also publish a value restored from the backup.
+            if after[1] is not before[1]:
+                self._generation = self.shared.publish(after[0], new_generation=True)
+            elif after[0] != before[0]:
+                self.shared.publish(after[0], new_generation=False)
+            return outcome
+
+    def _refresh(self):
+        """
+        Return the outcome: `updated`, `unchanged`, or `failed`.
+        """
         curtime = time()
+        self._last_refresh_attempt_time = curtime
         log.info("%s: refresh triggered", self)
 
-        # `newval` can be a dict, or a pandas dataframe, anything pickleable.
+        # `newval` can be a byte sequence, or a `Table` (anything
+        # `backupcodec` can handle). Or `UNCHANGED`: `fetch_func()` has
+        # determined that the upstream data has not changed since the last
+        # refresh.
         try:
             newval = self.fetch_func()
+            if newval is UNCHANGED and self.current_value[1] is None:
+                raise Exception("fetch_func() returned UNCHANGED, but no value")
         except Exception as err:
             log.exception("%s: error during fetch", self)
             if self.current_value[0] is not None:
                 log.info("%s: keep current cache value", self)
             else:
-                self._set_value_from_firestore_backup()
+                self._set_value_from_backup()
             # Consumers rely on the fact that when _refresh() does not
             # error out, that the current value is _not_ the initial value
             # anymore, i.e. that either the actual refresh or the restore
             # from backup have succeeded.
-            return
+            return "failed"
+
+        if newval is UNCHANGED:
+            # Nothing to prepare, nothing to back up. Just record that the
+            # current value is confirmed to be fresh.
+            log.info("%s: upstream data unchanged, keep current value", self)
+            self.current_value = (curtime, self.current_value[1])
+            self._write_snapshot_time(curtime)
+            return "unchanged"
 
         # Atomically set what we've got (for other racers to potentially
         # consume this already).
-        self.current_value = (curtime, newval)
-
-        byteseq = pickle.dumps(newval, protocol=pickle.HIGHEST_PROTOCOL)
-        log.info("%s: write backup to firestore, %s bytes", self, len(byteseq))
-        backup_dict = {"time": curtime, self.picklekey: byteseq}
+        self.current_value = (curtime, self._prepare(newval))
+        self._write_snapshot(curtime, newval)
 
         try:
             # I have seen this fail transiently with
             # google.api_core.exceptions.ServiceUnavailable: 503 Connection reset by peer
-            self.fbdoc.set(backup_dict)
+            self._write_backup(curtime, newval)
         except Exception as err:
-            log.exception("%s: err during firestore set(): %s", self, err)
+            log.exception("%s: err during backup: %s", self, err)
             # Not being able to set a fresh backup is sad, but not fatal.
 
+        return "updated"
+
     def __str__(self):
         return self.__class__.__name__
 
 
+class TimeseriesDocs:
+    """
+    The state/metric time series documents, built from one version of
+    data.csv, in each of the output formats (`OUTPUT_FORMATS_AVAILABLE`).
+
+    `full`: maps (state, metric, format) to the `Artifact` for the entire
+    series.
+
+    `epochs`: sorted list of Unix timestamps, one per row. Allows for
+    finding the rows of a time range via binary search.
+
+    `slice()`: build the document for a range of rows from pre-encoded row
+    fragments (one per row and state/metric/format), i.e. w/o encoding
+    anything in the request path. Arrow tables are sliced w/o copying, and
+    then serialized.
+
+    `all`: maps format to the `Artifact` for the columnar document
+    containing every column. The JSON variant has one array of time
+    strings, and one array of values per column. Encoded compactly (w/o
+    pretty-printing): this one is for machines.
+    """
+
+    def __init__(self, table):
+        if not table.is_sorted():
+            log.warning("data.csv rows are not sorted by time, sort")
+            table = table.sorted()
+        epochs = list(table.timestamps)
+        self.epochs = epochs
+        timestrings = table.index
+
+        self._rows = {}
+        self._arrow_tables = {}
+        self.full = {}
+        for state in STATE_WHITELIST:
+            for metric in METRIC_WHITELIST:
+                # Construct column name like DE-BW_cases
+                column_name = state + METRIC_SUFFIX_MAP[metric]
+                values = list(table.columns[column_name])
+                for fmt in OUTPUT_FORMATS_AVAILABLE:
+                    key = (state, metric, fmt)
+                    if fmt == "arrow":
+                        atable = pyarrow.table(
+                            {
+                                "time": _arrow_time_array(epochs),
+                                column_name: pyarrow.array(values),
+                            }
+                        )
+                        self._arrow_tables[key] = atable
+                        body = _arrow_ipc_bytes(atable)
+                    else:
+                        layout, rows = _encode_series_rows(
+                            fmt,
+                            timestrings,
+                            values,
+                            column_name,
+                            TIMESERIES_JSON_OUTPUT_META_DICT,
+                        )
+                        self._rows[key] = (layout, rows)
+                        body = _assemble_rows(layout, rows, 0, len(rows))
+                    self.full[key] = Artifact(body, OUTPUT_FORMATS[fmt])
+
+        self.all = {}
+        columns = {c: list(v) for c, v in table.columns.items()}
+        compact = Artifact(
+            _json_bytes_compact(
+                {
+                    "time_iso8601": timestrings,
+                    "columns": columns,
+                    "meta": TIMESERIES_JSON_OUTPUT_META_DICT,
+                }
+            )
+        )
+        self.all["json"] = self.all["json-compact"] = compact
+        self.all["csv"] = Artifact(
+            _csv_bytes(["time_iso8601", *columns], zip(timestrings, *columns.values())),
+            OUTPUT_FORMATS["csv"],
+        )
+        self.all["ndjson"] = Artifact(
+            b"".join(
+                _json_bytes_compact(dict(zip(["time_iso8601", *columns], row))) + b"\n"
+                for row in zip(timestrings, *columns.values())
+            ),
+            OUTPUT_FORMATS["ndjson"],
+        )
+        if pyarrow is not None:
+            atable = pyarrow.table(
+                {
+                    "time": _arrow_time_array(epochs),
+                    **{c: pyarrow.array(v) for c, v in columns.items()},
+                }
+            )
+            self.all["arrow"] = Artifact(
+                _arrow_ipc_bytes(atable), OUTPUT_FORMATS["arrow"]
+            )
+
+    def slice(self, state, metric, lo, hi, fmt="json"):
+        """
+        Return `Artifact` for rows [lo, hi).
+        """
+        key = (state, metric, fmt)
+        full = self.full[key]
+        if lo <= 0 and hi >= len(self.epochs):
+            return full
+        lo, hi = max(lo, 0), max(hi, lo)
+        if fmt == "arrow":
+            body = _arrow_ipc_bytes(self._arrow_tables[key].slice(lo, hi - lo))
+        else:
+            body = _assemble_rows(*self._rows[key], lo, hi)
+        # The slice is uniquely identified by the row range (and the version of
+        # the complete document): no need to hash. The rows being requested
+        # are typically few: do not compress.
+        return Artifact(
+            body,
+            OUTPUT_FORMATS[fmt],
+            etag=f"{full.etag}-{lo}-{hi}",
+            compress=False,
+        )
+
+
 class CacheTimeseries(Cache):
+
+    URL = f"{DATA_REPO_RAW_URL}/data.csv"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # State of the last successful fetch: (validator headers, raw CSV
+        # byte sequence, `Table`).
+        self._last_fetch = None
+
     def fetch_func(self):
-        url = "https://raw.githubusercontent.com/jgehrcke/covid-19-germany-gae/master/data.csv"
-        log.info("read csv data from github: %s", url)
-        resp = requests.get(url)
+        """
+        Refresh incrementally, where possible: send a conditional request (and
+        return `UNCHANGED` upon 304). If the CSV document only got rows
+        appended, only parse those and append them to the previous table.
+        Fall back to parsing the entire document otherwise.
+
+        Use pandas for parsing, but return a `Table`.
+        """
+        last = self._last_fetch
+        # Only rely on the previous state if the cache still holds the
+        # corresponding value.
+        if self.current_value[1] is None:
+            last = None
+
+        headers = {}
+        if last is not None:
+            headers = _conditional_request_headers(last[0])
+
+        log.info("read csv data from github: %s", self.URL)
+        resp = _upstream_get(
+            "github", self.URL, headers=headers, budget_seconds=GITHUB_BUDGET_SECONDS
+        )
+        if resp.status_code == 304 and last is not None:
+            log.info("%s: github says: not modified", self)
+            return UNCHANGED
         resp.raise_for_status()
 
-        # Using the iso8601 time strings as index has the advantage that individual
-        # colunmns (Series objects) are JSON-encode-ready by just doing
-        # `Series.to_dict()` yields an ordered map of timestamp:value pairs.
-        df = pd.read_csv(io.StringIO(resp.text), index_col=["time_iso8601"])
-        df = df.dropna()
-        return df
+        content = resp.content
+        validators = _validators_from_response(resp)
+
+        table = None
+        if last is not None:
+            table = self._parse_appended_rows(last, content)
+            if table is UNCHANGED:
+                self._last_fetch = (validators, content, last[2])
+                return UNCHANGED
+
+        if table is None:
+            log.info("%s: parse entire CSV document", self)
+            df = pd.read_csv(io.BytesIO(content), index_col=["time_iso8601"])
+            table = Table.from_dataframe(df.dropna())
+
+        self._last_fetch = (validators, content, table)
+        return table
+
+    def _parse_appended_rows(self, last, content):
+        """
+        Return the new `Table` if `content` is the previous CSV document
+        with rows appended. Return `UNCHANGED` if it is the same document.
+        Return `None` if history has been rewritten.
+        """
+        _, last_content, last_table = last
+
+        if not content.startswith(last_content) or not last_content.endswith(b"\n"):
+            log.info("%s: CSV document was rewritten", self)
+            return None
+
+        appended = content[len(last_content) :]
+        if not appended.strip():
+            log.info("%s: CSV document did not change", self)
+            return UNCHANGED
+
+        headerline = content[: content.index(b"\n") + 1]
+        df_new = pd.read_csv(
+            io.BytesIO(headerline + appended), index_col=["time_iso8601"]
+        )
+        new = Table.from_dataframe(df_new.dropna())
+
+        # Expect appended samples to be newer than what we have.
+        if len(new) and len(last_table):
+            if min(new.timestamps) <= last_table.timestamps[-1]:
+                log.info("%s: appended rows are not newer than last row", self)
+                return None
+
+        try:
+            table = last_table.append(new)
+        except ValueError as err:
+            # E.g. column data type changed.
+            log.info("%s: cannot append rows: %s", self, err)
+            return None
+
+        log.info("%s: parsed %s appended row(s)", self, len(new))
+        return table
+
+    def _prepare(self, table):
+        """
+        Build the response bodies for each state/metric combination (see
+        `TimeseriesDocs`).
+        """
+        log.info("%s: pre-encode JSON documents", self)
+        return TimeseriesDocs(table)
+
+
+class ArtifactLRU:
+    """
+    Thread-safe LRU cache for `Artifact`s, bounded by the total size of all
+    variants of all entries (in bytes).
+    """
+
+    def __init__(self, max_bytes):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _size(artifact):
+        return sum(len(body) for body, _ in artifact.variants.values())
+
+    def free_bytes(self):
+        return self.max_bytes - self._bytes
+
+    def get(self, key):
+        with self._lock:
+            artifact = self._entries.get(key)
+            if artifact is not None:
+                self._entries.move_to_end(key)
+            return artifact
+
+    def put(self, key, artifact):
+        with self._lock:
+            if key in self._entries:
+                # A concurrent request has been faster.
+                return
+            self._entries[key] = artifact
+            self._bytes += self._size(artifact)
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= self._size(evicted)
+
+
+class AGSTimeseriesDocs:
+    """
+    County-level (AGS) time series, for cases and deaths.
+
+    Hold each series as compact integer array. JSON documents are encoded
+    lazily (upon first request for a specific AGS/metric) and kept in a
+    size-bounded LRU cache: most of the ~800 documents are rarely requested,
+    so there's no point in pre-encoding all of them upon each refresh. That
+    happens in the request path, so compress quickly (see `Artifact`).
+    """
+
+    # Budget for encoded documents (incl. compressed variants).
+    lru_max_bytes = 16 * 1024 * 1024
+
+    def __init__(self, table):
+        if not table.is_sorted():
+            log.warning("AGS rows are not sorted by time, sort")
+            table = table.sorted()
+        self.timestrings = table.index
+        # Sorted: allows for finding the rows of a time range via binary
+        # search (see `slice()`).
+        self.epochs = table.timestamps
+        self.columns = {}
+        for cname, values in table.columns.items():
+            ags, metric = cname.rsplit("_", 1)
+            if ags not in AGS_PROPERTY_DICT:
+                # E.g. the `sum` column.
+                continue
+            typecode = "i" if max(values, default=0) < 2 ** 31 else "q"
+            self.columns[(ags, metric)] = array(typecode, values)
+        self._lru = ArtifactLRU(self.lru_max_bytes)
+
+    def get(self, ags, metric, fmt="json"):
+        """
+        Return `Artifact` in output format `fmt`, or `None` if there is no
+        data for that AGS.
+        """
+        key = (ags, metric, fmt)
+        artifact = self._lru.get(key)
+        if artifact is not None:
+            return artifact
+
+        values = self.columns.get((ags, metric))
+        if values is None:
+            return None
+
+        artifact = Artifact(
+            self._encode(ags, metric, 0, len(values), fmt),
+            OUTPUT_FORMATS[fmt],
+            fast=True,
+        )
+        self._lru.put(key, artifact)
+        return artifact
+
+    def slice(self, ags, metric, lo, hi, fmt="json"):
+        """
+        Return `Artifact` for rows [lo, hi), or `None` if there is no data
+        for that AGS. Not cached: encode only the rows requested (typically
+        few), do not compress.
+        """
+        if (ags, metric) not in self.columns:
+            return None
+        if lo <= 0 and hi >= len(self.epochs):
+            return self.get(ags, metric, fmt)
+        lo, hi = max(lo, 0), max(hi, lo)
+        return Artifact(
+            self._encode(ags, metric, lo, hi, fmt),
+            OUTPUT_FORMATS[fmt],
+            compress=False,
+        )
+
+    def _encode(self, ags, metric, lo, hi, fmt):
+        values = self.columns[(ags, metric)][lo:hi]
+        value_name = f"{ags}_{metric}"
+        if fmt == "arrow":
+            table = pyarrow.table(
+                {
+                    "time": _arrow_time_array(self.epochs[lo:hi]),
+                    value_name: pyarrow.array(values, type=pyarrow.int64()),
+                }
+            )
+            return _arrow_ipc_bytes(table)
+        layout, rows = _encode_series_rows(
+            fmt,
+            self.timestrings[lo:hi],
+            values,
+            value_name,
+            AGS_TIMESERIES_JSON_OUTPUT_META_DICT,
+        )
+        return _assemble_rows(layout, rows, 0, len(rows))
+
+    def preencode(self, fmt="json"):
+        """
+        Encode documents in output format `fmt`, for counties in order of
+        population (as a proxy for popularity), until the LRU cache is full.
+        """
+        agss = sorted(
+            {ags for ags, _ in self.columns},
+            key=lambda a: AGS_PROPERTY_DICT[a].get("population", 0),
+            reverse=True,
+        )
+        keys = [(ags, m) for ags in agss for m in METRIC_WHITELIST]
+        n = size = 0
+        # Stop before evicting: use the size of the previous document as
+        # estimate.
+        while n < len(keys) and self._lru.free_bytes() > size:
+            size = ArtifactLRU._size(self.get(*keys[n], fmt))
+            n += 1
+        log.info("pre-encoded %s county-level documents", n)
+
+
+class CacheTimeseriesAGS(Cache):
+
+    URLS = {
+        metric: f"{DATA_REPO_RAW_URL}/{metric}-rki-by-ags.csv"
+        for metric in METRIC_WHITELIST
+    }
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Validator headers (ETag, Last-Modified) of the last successful
+        # fetch, per URL.
+        self._validators = {}
+
+    def fetch_func(self):
+        """
+        Return a `Table` with one column per AGS and metric, with column
+        names like `1001_cases`. Return `UNCHANGED` if neither CSV document
+        has changed since the last fetch.
+        """
+        conditional = self.current_value[1] is not None
+        responses = {}
+        for metric, url in self.URLS.items():
+            headers = {}
+            if conditional:
+                headers = _conditional_request_headers(self._validators.get(url, {}))
+            log.info("read csv data from github: %s", url)
+            responses[metric] = _upstream_get(
+                "github",
+                url,
+                headers=headers,
+                timeout=(3.05, 30),
+                budget_seconds=GITHUB_BUDGET_SECONDS,
+            )
+
+        if all(r.status_code == 304 for r in responses.values()):
+            log.info("%s: github says: not modified", self)
+            return UNCHANGED
+
+        dataframes = []
+        for metric, resp in responses.items():
+            if resp.status_code == 304:
+                # Need both documents for building the new value.
+                resp = responses[metric] = _upstream_get(
+                    "github",
+                    self.URLS[metric],
+                    timeout=(3.05, 30),
+                    budget_seconds=GITHUB_BUDGET_SECONDS,
+                )
+            resp.raise_for_status()
+            df = pd.read_csv(io.BytesIO(resp.content), index_col=["time_iso8601"])
+            df = df.rename(columns=lambda c: f"{c}_{metric}")
+            dataframes.append(df)
+
+        df = pd.concat(dataframes, axis=1, join="inner").dropna().astype("int64")
+
+        for metric, resp in responses.items():
+            self._validators[self.URLS[metric]] = _validators_from_response(resp)
+        return Table.from_dataframe(df)
+
+    def _prepare(self, table):
+        return AGSTimeseriesDocs(table)
+
+
+class CacheSevenDayIncidence(Cache):
+    """
+    The most recent 7-day incidence value for each county (AGS), and for all
+    of Germany, based on the output of tools/7di.py.
+    """
+
+    URL = f"{DATA_REPO_RAW_URL}/more-data/7di-rki-by-ags.csv"
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._validators = {}
+
+    def fetch_func(self):
+        headers = {}
+        if self.current_value[1] is not None:
+            headers = _conditional_request_headers(self._validators)
+
+        log.info("read csv data from github: %s", self.URL)
+        resp = _upstream_get(
+            "github",
+            self.URL,
+            headers=headers,
+            timeout=(3.05, 30),
+            budget_seconds=GITHUB_BUDGET_SECONDS,
+        )
+        if resp.status_code == 304 and headers:
+            log.info("%s: github says: not modified", self)
+            return UNCHANGED
+        resp.raise_for_status()
+
+        df = pd.read_csv(io.BytesIO(resp.content), index_col=["time_iso8601"])
+        self._validators = _validators_from_response(resp)
+        table = Table.from_dataframe(df)
+        if len(table):
+            # Only the latest row is served. Keep only that one: also in the
+            # snapshot and the backup (instead of ~1 MB for all rows).
+            table = table.take([len(table) - 1])
+        return table
+
+    def _prepare(self, table):
+        """
+        Pick the latest value from each column. Return a dictionary with the
+        AGS (or `germany`) as key, and the pre-encoded JSON document as
+        value: one lookup per request.
+        """
+        log.info("%s: pre-encode JSON documents for latest values", self)
+        docs = {}
+        if not len(table):
+            return docs
+        for cname, values in table.columns.items():
+            value = values[-1]
+            if math.isnan(value):
+                continue
+            # Column names are like `1001_7di`, and `germany_7di`.
+            key = cname[: -len("_7di")]
+            if key == "germany":
+                name = "Deutschland"
+            elif key in AGS_PROPERTY_DICT:
+                name = AGS_PROPERTY_DICT[key]["name"]
+            else:
+                continue
+            docs[key] = Artifact(
+                _json_bytes_pretty(
+                    {
+                        "ags": key,
+                        "name": name,
+                        "7di": float(value),
+                        "time_iso8601": table.index[-1],
+                        "meta": SEVEN_DAY_INCIDENCE_JSON_OUTPUT_META_DICT,
+                    }
+                )
+            )
+        return docs
+
+
+class UpstreamDocument:
+    """
+    A document fetched from an upstream source, and the result of parsing
+    it. Remember validators, content digest and parse result of the last
+    successful fetch: send conditional requests, and only parse again if the
+    document changed.
+
+    `url_func()` returns the URL to fetch, `parse_func(resp)` the parse
+    result.
+
+    Thread-safe: `get()` calls can overlap (a straggler left behind by a
+    previous refresh, see `CacheNow`). The state of the most recently
+    started call that succeeded wins.
+    """
+
+    def __init__(self, source, url_func, parse_func, **fetch_kwargs):
+        self.source = source
+        self.url_func = url_func
+        self.parse_func = parse_func
+        self.fetch_kwargs = fetch_kwargs
+        # (validator headers, SHA1 digest of the content, parse result).
+        self._last = None
+        # Sequence number of the `get()` call that set `_last`.
+        self._last_seq = 0
+        self._seq = 0
+        self._lock = threading.Lock()
+
+    def _store(self, seq, last):
+        with self._lock:
+            if seq > self._last_seq:
+                self._last = last
+                self._last_seq = seq
+
+    def get(self):
+        """
+        Return the parse result of the current document. That is the same
+        object as returned before if the document did not change.
+        """
+        with self._lock:
+            self._seq += 1
+            seq = self._seq
+            last = self._last
+        headers = {}
+        if last is not None:
+            headers = _conditional_request_headers(last[0])
+
+        url = self.url_func()
+        log.info("%s: fetch %s", self.source, url)
+        resp = _upstream_get(self.source, url, headers=headers, **self.fetch_kwargs)
+        if resp.status_code == 304 and last is not None:
+            log.info("%s: not modified (304)", self.source)
+            return last[2]
+
+        validators = _validators_from_response(resp)
+        digest = hashlib.sha1(resp.content).hexdigest()
+        if last is not None and digest == last[1]:
+            log.info("%s: not modified (same content)", self.source)
+            self._store(seq, (validators, digest, last[2]))
+            return last[2]
+
+        parsed = self.parse_func(resp)
+        self._store(seq, (validators, digest, parsed))
+        return parsed
 
 
 class CacheNow(Cache):
+
+    # Overall time budget for consulting the upstream sources during a
+    # refresh, in seconds. Note that the cron job age limit is 3 minutes.
+    fetch_deadline_seconds = 25
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.sources = {
+            "TS/Rl/CS case count": UpstreamDocument(
+                "rl",
+                lambda: RL_TS_CSV_URL,
+                parse_case_data_from_ts_rl,
+                attempts=2,
+                timeout=(1.0, 5.0),
+                budget_seconds=NOW_SOURCE_BUDGET_SECONDS,
+                hedge_percentile=NOW_SOURCE_HEDGE_PERCENTILE,
+            ),
+            "ZO /now": UpstreamDocument(
+                "zeit",
+                lambda: f"{ZEIT_JSON_URL}?time={int(time())}",
+                parse_now_data_from_zeit,
+                timeout=(3.05, 10),
+                budget_seconds=NOW_SOURCE_BUDGET_SECONDS,
+                hedge_percentile=NOW_SOURCE_HEDGE_PERCENTILE,
+            ),
+            "BM /now": UpstreamDocument(
+                "mopo",
+                lambda: f"{BE_MOPO_CSV_URL}?{int(time())}",
+                parse_now_data_from_be_mopo,
+                timeout=(3.05, 10),
+                budget_seconds=NOW_SOURCE_BUDGET_SECONDS,
+                hedge_percentile=NOW_SOURCE_HEDGE_PERCENTILE,
+            ),
+        }
+        # Parse results the current JSON document was built from.
+        self._last_inputs = None
+
+    def _prepare(self, jsondoc):
+        return Artifact(jsondoc, content_type="application/json; charset=utf-8")
+
     def fetch_func(self):
         def _to_json_doc(data, current_case_count_risklayer):
             log.info("%s: serialize data to JSON", self)
@@ -325,32 +2011,58 @@ class CacheNow(Cache):
 
             return json.dumps(output_dict, indent=2, ensure_ascii=False).encode("utf-8")
 
-        data_zo = None
-        data_mopo = None
-        current_case_count_rl = None
-
-        try:
-            current_case_count_rl = get_fresh_case_data_from_ts_rl()
-        except Exception as err:
-            log.exception("err during TS/Rl/CS case count fetch: %s", err)
-
-        try:
-            data_zo = get_fresh_now_data_from_zeit()
-        except Exception as err:
-            log.exception("err during ZO /now fetch: %s", err)
+        # Consult all sources concurrently, so that refresh latency is
+        # determined by the slowest source, not by the sum of all of them.
+        # Do not wait for longer than the overall deadline: use what's there
+        # by then, and ignore stragglers.
+        executor = ThreadPoolExecutor(
+            max_workers=len(self.sources), thread_name_prefix="fetch-now"
+        )
+        futures = {executor.submit(doc.get): name for name, doc in self.sources.items()}
+        done, not_done = wait(futures, timeout=self.fetch_deadline_seconds)
+
+        # Do not block on stragglers. Their threads finish in the background
+        # (bounded by their individual request timeouts), the results are
+        # discarded.
+        executor.shutdown(wait=False)
+        for fut in not_done:
+            fut.cancel()
+            log.warning(
+                "%s fetch did not complete within %s s, ignore",
+                futures[fut],
+                self.fetch_deadline_seconds,
+            )
 
-        try:
-            data_mopo = get_fresh_now_data_from_be_mopo()
-        except Exception as err:
-            log.exception("err during BM /now fetch: %s", err)
+        results = {}
+        for fut in done:
+            try:
+                results[futures[fut]] = fut.result()
+            except Exception as err:
+                log.exception("err during %s fetch: %s", futures[fut], err)
+
+        current_case_count_rl = results.get("TS/Rl/CS case count")
+        data_zo = results.get("ZO /now")
+        data_mopo = results.get("BM /now")
+
+        if data_zo is None and data_mopo is None:
+            raise Exception("neither got data from ZO nor from BM")
+
+        # Only build a new JSON document if any of the inputs changed. Note
+        # that then `time_source_last_consulted_iso8601` refers to the last
+        # time data was obtained that differed from the data before.
+        inputs = (current_case_count_rl, data_zo, data_mopo)
+        if inputs == self._last_inputs and self.current_value[1] is not None:
+            log.info("%s: no source changed", self)
+            return UNCHANGED
+        self._last_inputs = inputs
 
         # If one of the sources let us down, short-cut to returning data from
         # the other right away.
         if data_zo is None:
-            return _to_json_doc(data_zo, current_case_count_rl)
+            return _to_json_doc(data_mopo, current_case_count_rl)
 
         if data_mopo is None:
-            return _to_json_doc(data_mopo, current_case_count_rl)
+            return _to_json_doc(data_zo, current_case_count_rl)
 
         # Got data from both. Use more recent or use higher case count?
         if data_zo["time_source_last_updated"] > data_mopo["time_source_last_updated"]:
@@ -367,19 +2079,16 @@ class CacheNow(Cache):
             return _to_json_doc(data_mopo, current_case_count_rl)
 
 
-def get_fresh_now_data_from_zeit():
+def parse_now_data_from_zeit(resp):
     def _parse_zo_timestring_into_dt(timestring):
         # This is the third iteration already, as ZO changes their implementation
         # often. They came to reason and now use ISO 8601.
         return datetime.strptime(timestring, "%Y-%m-%dT%H:%M:%S%z")
 
-    url = f"{ZEIT_JSON_URL}?time={int(time())}"
-    log.info("try to get current case count for germany from zeit online")
+    log.info("parse current case count for germany from zeit online")
 
     # today = datetime.utcnow().strftime("%Y-%m-%d")
 
-    resp = requests.get(url, timeout=(3.05, 10))
-    resp.raise_for_status()
     data = resp.json()
 
     # First let's see that data is roughly in the shape that's expected
@@ -401,31 +2110,14 @@ def get_fresh_now_data_from_zeit():
     }
 
 
-def get_fresh_case_data_from_ts_rl():
-    log.info("fetch RL/TS/CS data from gsheets")
-    for attempt in (1, 2):
-        try:
-            resp = requests.get(os.environ["RL_TS_CSV_URL"], timeout=(1.0, 5.0))
-            resp.raise_for_status()
-        except Exception as err:
-            log.info("attempt %s: failed getting data: %s", attempt, err)
-
+def parse_case_data_from_ts_rl(resp):
+    log.info("parse RL/TS/CS data from gsheets")
     df = pd.read_csv(io.StringIO(resp.text))
     return int(df["current"].sum())
 
 
-def get_fresh_now_data_from_be_mopo():
-    url = f"{BE_MOPO_CSV_URL}?{int(time())}"
-    log.info("try to get current case count for germany from berliner mopo")
-
-    for attempt in (1, 2, 3):
-        # TODO: back-off, but only when this is not in hot path
-        try:
-            resp = requests.get(url, timeout=(3.05, 10))
-            resp.raise_for_status()
-        except Exception as err:
-            log.info("attempt %s: failed getting data: %s", attempt, err)
-
+def parse_now_data_from_be_mopo(resp):
+    log.info("parse current case count for germany from berliner mopo")
     df = pd.read_csv(io.StringIO(resp.text))
     df = df.dropna()
     df = df[df["parent"].str.match("Deutschland")]
@@ -442,8 +2134,12 @@ def get_fresh_now_data_from_be_mopo():
     }
 
 
-CACHE_NOW = CacheNow("now", FS_NOW_DOC)
-CACHE_TIMESERIES = CacheTimeseries("ts", FS_TIMESERIES_DOC)
+CACHE_NOW = CacheNow("now", BACKUP_STORE, "gernow-3")
+CACHE_TIMESERIES = CacheTimeseries("ts", BACKUP_STORE, "gerhistory-3")
+CACHE_TIMESERIES_AGS = CacheTimeseriesAGS("ts-ags", BACKUP_STORE, "gerhistory-ags-1")
+CACHE_7DI = CacheSevenDayIncidence("7di", BACKUP_STORE, "ger7di-1")
+
+startup.checkpoint("execute main.py")
 
 
 if __name__ == "__main__":
@@ -0,0 +1,202 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Minimal in-process metrics (counters, gauges, histograms), rendered in the
+Prometheus text exposition format (version 0.0.4).
+
+Metric values live in the memory of the current process, i.e. each
+instance (and each uwsgi process) reports its own view. All operations are
+thread-safe.
+
+Usage:
+
+    REQUESTS = metrics.Counter("http_requests_total", "...", ["route"])
+    REQUESTS.inc(route="/now")
+
+    with LATENCY.time(route="/now"):
+        ...
+
+    metrics.render()
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import math
+import threading
+from contextlib import contextmanager
+from time import time
+
+
+# All metrics created in this process, in order of creation.
+REGISTRY = []
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Default histogram buckets (upper bounds, in seconds): from a fast dict
+# lookup in the request path to a slow upstream fetch.
+DEFAULT_BUCKETS = (
+    0.001,
+    0.0025,
+    0.005,
+    0.01,
+    0.025,
+    0.05,
+    0.1,
+    0.25,
+    0.5,
+    1.0,
+    2.5,
+    5.0,
+    10.0,
+    30.0,
+)
+
+
+class _Metric:
+
+    kind = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        # Map tuple of label values to the state of one time series.
+        self._series = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(
+                f"{self.name}: expected labels {self.labelnames}, got {tuple(labels)}"
+            )
+        return tuple(str(labels[n]) for n in self.labelnames)
+
+    def _labelstr(self, key, extra=()):
+        pairs = list(zip(self.labelnames, key)) + list(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in pairs) + "}"
+
+    def render(self):
+        lines = [
+            f"# HELP {self.name} {self.documentation}",
+            f"# TYPE {self.name} {self.kind}",
+        ]
+        with self._lock:
+            for key, state in sorted(self._series.items()):
+                lines.extend(self._render_series(key, state))
+        return lines
+
+
+class Counter(_Metric):
+
+    kind = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, key, value):
+        yield f"{self.name}{self._labelstr(key)} {_fmt(value)}"
+
+
+class Gauge(_Metric):
+
+    kind = "gauge"
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = value
+
+    def _render_series(self, key, value):
+        yield f"{self.name}{self._labelstr(key)} {_fmt(value)}"
+
+
+class Histogram(_Metric):
+
+    kind = "histogram"
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                # Per-bucket (non-cumulative) counts, plus one for +Inf. And
+                # the sum of all observed values.
+                state = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            counts = state[0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    counts[i] += 1
+                    break
+            else:
+                counts[-1] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """
+        Observe the duration of the `with` block (also if it raises).
+        """
+        t0 = time()
+        try:
+            yield
+        finally:
+            self.observe(time() - t0, **labels)
+
+    def _render_series(self, key, state):
+        counts, total = state
+        cumulative = 0
+        for bound, count in zip(self.buckets + (math.inf,), counts):
+            cumulative += count
+            le = (("le", _fmt(bound)),)
+            yield f"{self.name}_bucket{self._labelstr(key, le)} {cumulative}"
+        yield f"{self.name}_sum{self._labelstr(key)} {_fmt(total)}"
+        yield f"{self.name}_count{self._labelstr(key)} {cumulative}"
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _fmt(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(value)
+
+
+def render():
+    """
+    Return all metrics in the Prometheus text exposition format (str).
+    """
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,141 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Cache state shared across the processes of one instance (e.g. uwsgi
+workers), via a small mmapped file: a generation counter (incremented by
+each process that sets a new cache value, i.e. writes a new local snapshot)
+and the value time. Plus an exclusive lock on that file, held while
+refreshing: only one process talks to the upstream sources (and to the
+backup store) at any given time.
+
+This shares refreshes, not memory: each process still holds its own copy of
+each cache value, including the prepared response bodies (loaded from the
+local snapshot, then prepared once per generation). The memory footprint
+grows with the number of processes.
+
+    shared = sharedstate.SharedState("/tmp/cache-now.shared")
+    generation, valtime = shared.read()   # cheap, for every read access
+    with shared.lock(timeout_seconds=30) as acquired:
+        ...
+        shared.publish(valtime, new_generation=True)
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import fcntl
+import logging
+import mmap
+import os
+import struct
+import time
+from contextlib import contextmanager
+
+
+log = logging.getLogger(__file__)
+
+# Sequence number (odd while a write is in progress), generation, value time.
+_LAYOUT = struct.Struct("<QQd")
+
+
+def processes():
+    """
+    Return the number of worker processes of the uwsgi server running this
+    app, or 1 (e.g. not running under uwsgi).
+    """
+    try:
+        import uwsgi
+    except ImportError:
+        return 1
+    return uwsgi.numproc
+
+
+class SharedState:
+    """
+    Create the file at `path` if it does not exist yet. Use the same `path`
+    in all processes.
+
+    The mapping can be inherited by forked processes. The lock can not (flock
+    locks belong to the open file description): open the file again for each
+    `lock()`.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            # Concurrent initialization: extending the file is idempotent,
+            # and it starts out zeroed.
+            if os.fstat(fd).st_size < _LAYOUT.size:
+                os.ftruncate(fd, _LAYOUT.size)
+            self._mm = mmap.mmap(fd, _LAYOUT.size)
+        finally:
+            os.close(fd)
+
+    def read(self):
+        """
+        Return (generation, value time). Generation 0: no value yet.
+        """
+        while True:
+            seq, generation, valtime = _LAYOUT.unpack_from(self._mm)
+            if seq % 2 == 0 and _LAYOUT.unpack_from(self._mm)[0] == seq:
+                return generation, valtime
+            # A writer is in progress (writes are short, and serialized
+            # through `lock()`).
+            time.sleep(0)
+
+    def publish(self, valtime, new_generation):
+        """
+        Set the value time. Increment the generation if `new_generation`.
+        Return the (new) generation. Must be called while holding `lock()`.
+        """
+        seq, generation, _ = _LAYOUT.unpack_from(self._mm)
+        if new_generation:
+            generation += 1
+        _LAYOUT.pack_into(self._mm, 0, seq + 1, generation, valtime)
+        _LAYOUT.pack_into(self._mm, 0, seq + 2, generation, valtime)
+        return generation
+
+    @contextmanager
+    def lock(self, timeout_seconds):
+        """
+        Acquire the exclusive (inter-process) lock, waiting for up to
+        `timeout_seconds`. Yield `True` if acquired, `False` otherwise.
+        """
+        fd = os.open(self.path, os.O_RDWR)
+        try:
+            deadline = time.monotonic() + timeout_seconds
+            while True:
+                try:
+                    fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                    break
+                except BlockingIOError:
+                    if time.monotonic() > deadline:
+                        yield False
+                        return
+                    time.sleep(0.05)
+            try:
+                yield True
+            finally:
+                fcntl.flock(fd, fcntl.LOCK_UN)
+        finally:
+            os.close(fd)
@@ -0,0 +1,155 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Cold start helpers: deferred imports of heavy modules, and a timing report
+of where boot time goes.
+
+    pd = startup.LazyModule("pandas")   # imported upon first attribute access
+    startup.load_lazy_modules()         # or: import all of them now
+    startup.checkpoint("import flask")  # end of a startup phase
+    startup.log_report_once()           # e.g. after the first request
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import importlib
+import logging
+import os
+import threading
+from time import time
+
+
+log = logging.getLogger(__file__)
+
+# (phase name, end time) tuples, in order. The first one marks the start.
+_checkpoints = [("start", time())]
+
+# (module name, import duration in seconds) tuples, in order of import.
+_lazy_imports = []
+
+# All `LazyModule` instances, see `load_lazy_modules()`.
+_lazy_modules = []
+
+_report_lock = threading.Lock()
+
+# Set once the report has been logged.
+reported = False
+
+
+def checkpoint(name):
+    """
+    Mark the end of startup phase `name` (which started with the previous
+    checkpoint).
+    """
+    _checkpoints.append((name, time()))
+
+
+class LazyModule:
+    """
+    Stand-in for a module: import it upon first attribute access. Import
+    `submodules` (full names), too.
+    """
+
+    def __init__(self, name, submodules=()):
+        self._name = name
+        self._submodules = submodules
+        self._module = None
+        self._lock = threading.Lock()
+        _lazy_modules.append(self)
+
+    def _load(self):
+        with self._lock:
+            if self._module is None:
+                t0 = time()
+                module = importlib.import_module(self._name)
+                for name in self._submodules:
+                    importlib.import_module(name)
+                duration = time() - t0
+                _lazy_imports.append((self._name, duration))
+                log.info("lazy import of %s took %.3f s", self._name, duration)
+                self._module = module
+        return self._module
+
+    def __getattr__(self, attr):
+        return getattr(self._module or self._load(), attr)
+
+
+def load_lazy_modules():
+    """
+    Import all modules deferred with `LazyModule` now (e.g. during warmup).
+    """
+    for m in _lazy_modules:
+        if m._module is None:
+            m._load()
+
+
+def _process_start_time():
+    """
+    Return the Unix time of the start of this process (Linux only), or
+    `None`.
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # Field 22: start time in clock ticks since boot. The command
+            # name (field 2) can contain spaces: split after it.
+            starttime_ticks = int(f.read().rsplit(")", 1)[1].split()[19])
+        with open("/proc/stat") as f:
+            btime = next(int(l.split()[1]) for l in f if l.startswith("btime"))
+        return btime + starttime_ticks / os.sysconf("SC_CLK_TCK")
+    except Exception:
+        return None
+
+
+def phases():
+    """
+    Return list of (phase name, duration in seconds) tuples.
+    """
+    result = []
+    pstart = _process_start_time()
+    # In a pre-forked worker process the process started after the import.
+    if pstart is not None and pstart < _checkpoints[0][1]:
+        result.append(("process start to app import", _checkpoints[0][1] - pstart))
+    for (_, t0), (name, t1) in zip(_checkpoints, _checkpoints[1:]):
+        result.append((name, t1 - t0))
+    result.extend((f"lazy import {n}", d) for n, d in _lazy_imports)
+    return result
+
+
+def log_report_once(extra=()):
+    """
+    Log the startup timing report, unless that has happened before. Append
+    `extra` phases: (name, duration in seconds) tuples. Return `True` if
+    logged.
+    """
+    global reported
+    with _report_lock:
+        if reported:
+            return False
+        reported = True
+
+    rows = phases() + list(extra)
+    log.info(
+        "startup timing report:\n%s",
+        "\n".join(f"  {name:<40} {duration:8.3f} s" for name, duration in rows),
+    )
+    return True
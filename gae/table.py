@@ -0,0 +1,144 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Lightweight column-oriented time series table: what the caches hold instead
+of pandas DataFrames. Pandas is only used for parsing CSV documents (in
+`fetch_func()` implementations), and is not needed for working with a
+`Table`.
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+from array import array
+from datetime import datetime
+
+
+# Map numpy dtype kind to `array` typecode. Other columns are held as lists
+# of str.
+_TYPECODE_BY_DTYPE_KIND = {"i": "q", "f": "d"}
+
+
+class Table:
+    """
+    Rows are indexed by time: `index` is a list of ISO 8601 time strings
+    (as read from the source document), `timestamps` the corresponding Unix
+    timestamps.
+
+    `columns` maps column name to the column values, in order: an
+    `array('q')` (integers), `array('d')` (floats), or a list of str.
+
+    Treat as immutable.
+    """
+
+    __slots__ = ("index_name", "index", "timestamps", "columns")
+
+    def __init__(self, index, columns, index_name="time_iso8601", timestamps=None):
+        self.index_name = index_name
+        self.index = index
+        if timestamps is None:
+            timestamps = array("d", (parse_time(t).timestamp() for t in index))
+        self.timestamps = timestamps
+        self.columns = columns
+        for name, values in columns.items():
+            if len(values) != len(index):
+                raise ValueError(f"column {name}: unexpected length {len(values)}")
+
+    @classmethod
+    def from_dataframe(cls, df):
+        columns = {}
+        for name in df:
+            col = df[name]
+            typecode = _TYPECODE_BY_DTYPE_KIND.get(col.dtype.kind)
+            if typecode is None:
+                columns[name] = [str(v) for v in col]
+            else:
+                columns[name] = array(typecode, col.tolist())
+        return cls([str(t) for t in df.index], columns, index_name=df.index.name)
+
+    def __len__(self):
+        return len(self.index)
+
+    def is_sorted(self):
+        ts = self.timestamps
+        return all(a <= b for a, b in zip(ts, ts[1:]))
+
+    def take(self, positions):
+        """
+        Return new `Table` with the rows at `positions` (in that order).
+        """
+        return Table(
+            [self.index[i] for i in positions],
+            {name: _take(values, positions) for name, values in self.columns.items()},
+            index_name=self.index_name,
+            timestamps=_take(self.timestamps, positions),
+        )
+
+    def sorted(self):
+        """
+        Return `Table` with rows sorted by time (`self` if already sorted).
+        """
+        if self.is_sorted():
+            return self
+        ts = self.timestamps
+        return self.take(sorted(range(len(ts)), key=ts.__getitem__))
+
+    def append(self, other):
+        """
+        Return new `Table` with the rows of `other` (same columns) appended.
+        """
+        if other._schema() != self._schema():
+            raise ValueError("cannot append: columns differ")
+        return Table(
+            self.index + other.index,
+            {
+                name: values + other.columns[name]
+                for name, values in self.columns.items()
+            },
+            index_name=self.index_name,
+            timestamps=self.timestamps + other.timestamps,
+        )
+
+    def _schema(self):
+        return [(name, _typecode(values)) for name, values in self.columns.items()]
+
+
+def _typecode(values):
+    return values.typecode if isinstance(values, array) else None
+
+
+def _take(values, positions):
+    if isinstance(values, array):
+        return array(values.typecode, (values[i] for i in positions))
+    return [values[i] for i in positions]
+
+
+def parse_time(timestring):
+    """
+    Parse ISO 8601 time string with UTC offset (with or w/o colon, such as
+    `2020-03-10T12:00:00+01:00` or `2020-03-02T17:00:00+0000`).
+    """
+    try:
+        return datetime.strptime(timestring, "%Y-%m-%dT%H:%M:%S%z")
+    except ValueError:
+        # E.g. with fractional seconds.
+        return datetime.fromisoformat(timestring)
@@ -0,0 +1 @@
+../lib/upstream.py
\ No newline at end of file
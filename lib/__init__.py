@@ -29,6 +29,7 @@ import logging
 from . import tsmath
 from . import io
 from . import const
+from . import upstream
 
 
 def init_logger():
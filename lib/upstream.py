@@ -0,0 +1,353 @@
+# MIT License
+
+# Copyright (c) 2020 - 2021 Dr. Jan-Philip Gehrcke -- https://gehrcke.de
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+
+"""
+Shared HTTP client for talking to upstream data sources.
+
+One module-level `requests.Session` with connection pooling, so that
+consecutive requests to the same host re-use an established (TCP, TLS)
+connection instead of paying for a fresh handshake each time.
+
+`fetch()`: GET with retrying (exponential backoff with jitter, within a
+total time budget), a per-source circuit breaker (fail fast on sources known
+to be down), and optional hedging (send a second request if the first one
+takes unusually long).
+
+Used by the tools in this repository (as `lib.upstream`) and by the GAE app
+(gae/upstream.py is a symlink to this file). Therefore this module must not
+import anything from `lib`.
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import logging
+import random
+import threading
+import time
+import urllib.parse
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+
+log = logging.getLogger(__file__)
+
+# Default (connect timeout, read timeout) in seconds, for callers that do not
+# pass their own `timeout`.
+DEFAULT_TIMEOUT = (3.05, 10)
+
+# Number of per-host connection pools to keep (i.e. number of distinct
+# upstream hosts we expect to talk to).
+POOL_HOSTS = 10
+
+# Maximum number of connections kept alive per host. More concurrent
+# requests to the same host are still possible, but excess connections are
+# discarded after use instead of being put back into the pool.
+POOL_MAXSIZE_PER_HOST = 5
+
+# Circuit breaker settings, see `_Source`.
+BREAKER_FAILURE_THRESHOLD = 3
+BREAKER_COOLDOWN_SECONDS = 120
+
+# Number of recent request latencies to keep per source, and the minimum
+# number required for deriving a hedging delay.
+LATENCY_WINDOW = 50
+LATENCY_MIN_SAMPLES = 10
+
+
+_session = None
+_session_lock = threading.Lock()
+
+
+def session():
+    """
+    Return the process-wide session, create it upon first use.
+
+    Creating it lazily (and not at import time) matters for pre-forking
+    servers: pooled connections must not be shared across processes.
+    """
+    global _session
+    if _session is None:
+        with _session_lock:
+            if _session is None:
+                _session = _create_session()
+    return _session
+
+
+def _create_session():
+    # Import here: `requests` takes a while to import, and the GAE app does
+    # not need it for serving from a warm cache.
+    import requests
+    import requests.adapters
+
+    log.info("create HTTP session for upstream requests")
+    s = requests.Session()
+    adapter = requests.adapters.HTTPAdapter(
+        pool_connections=POOL_HOSTS,
+        pool_maxsize=POOL_MAXSIZE_PER_HOST,
+        # Retrying: see `fetch()`.
+        max_retries=0,
+    )
+    s.mount("https://", adapter)
+    s.mount("http://", adapter)
+    return s
+
+
+class CircuitOpenError(Exception):
+    """
+    Raised by `fetch()` instead of sending a request to a source that is
+    considered down.
+    """
+
+
+class NonRetryableError(Exception):
+    """
+    Raise from a `fetch()` `check` function to fail w/o retrying.
+    """
+
+
+class _Source:
+    """
+    Per-source state: circuit breaker, and recent latencies (for hedging).
+
+    The breaker opens after `BREAKER_FAILURE_THRESHOLD` consecutive failed
+    `fetch()` calls (each after retrying), and stays open for
+    `BREAKER_COOLDOWN_SECONDS`. Then one call goes through (half-open):
+    success closes the breaker, failure opens it again.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = 0
+        self.probing = False
+        self.latencies = deque(maxlen=LATENCY_WINDOW)
+
+    def acquire(self):
+        """
+        Return `True` if a `fetch()` call may send requests now.
+        """
+        with self.lock:
+            if self.consecutive_failures < BREAKER_FAILURE_THRESHOLD:
+                return True
+            if time.monotonic() < self.open_until or self.probing:
+                return False
+            self.probing = True
+            return True
+
+    def record(self, ok, latency=None):
+        with self.lock:
+            self.probing = False
+            if ok:
+                self.consecutive_failures = 0
+                if latency is not None:
+                    self.latencies.append(latency)
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= BREAKER_FAILURE_THRESHOLD:
+                self.open_until = time.monotonic() + BREAKER_COOLDOWN_SECONDS
+
+    def latency_percentile(self, p):
+        with self.lock:
+            samples = sorted(self.latencies)
+        if len(samples) < LATENCY_MIN_SAMPLES:
+            return None
+        return samples[min(len(samples) - 1, int(p / 100.0 * len(samples)))]
+
+
+# Used for the hedged requests, created upon first use.
+_hedge_executor = None
+
+_sources = {}
+_sources_lock = threading.Lock()
+
+
+def _source(name):
+    with _sources_lock:
+        if name not in _sources:
+            _sources[name] = _Source()
+        return _sources[name]
+
+
+def _is_retryable_status(status_code):
+    return status_code >= 500 or status_code in (408, 429)
+
+
+def fetch(
+    url,
+    source=None,
+    attempts=3,
+    budget_seconds=30,
+    backoff_seconds=0.5,
+    backoff_max_seconds=10,
+    hedge_percentile=None,
+    check=None,
+    timeout=DEFAULT_TIMEOUT,
+    **kwargs,
+):
+    """
+    GET `url` via the shared session and return the response, retrying upon
+    failure. Raise the last error if all attempts failed.
+
+    Failures: request errors (e.g. timeout, connection reset), responses
+    with status code 5xx, 408 or 429, and exceptions raised by
+    `check(response)` (e.g. for detecting unexpected data). Other 4xx
+    responses raise `requests.HTTPError` right away (not retried). Raise
+    `NonRetryableError` from `check` for failing w/o retrying.
+
+    `source`: name of the upstream source (default: the host name), for the
+    circuit breaker. If the breaker is open, raise `CircuitOpenError` w/o
+    sending a request. The breaker is only checked before the first attempt:
+    once started, a call makes use of all its `attempts`. It counts as one
+    failure (or success) for the breaker.
+
+    `budget_seconds`: total time budget across all attempts, including
+    backoff. Each request's read timeout is capped at the remaining budget.
+
+    `backoff_seconds`, `backoff_max_seconds`: wait between attempts is drawn
+    uniformly from [0, min(max, base * 2^(attempt-1))] ("full jitter").
+
+    `hedge_percentile`: if set (e.g. 95), and the first request of an
+    attempt takes longer than that percentile of the recent latencies of
+    this source, send a second request, and use whichever response arrives
+    first. For idempotent, cheap requests only.
+    """
+    if source is None:
+        source = urllib.parse.urlsplit(url).netloc
+    state = _source(source)
+    if not state.acquire():
+        raise CircuitOpenError(f"{source}: circuit open, skip request")
+
+    try:
+        resp, latency = _get_with_retries(
+            url,
+            source,
+            state,
+            attempts,
+            time.monotonic() + budget_seconds,
+            backoff_seconds,
+            backoff_max_seconds,
+            hedge_percentile,
+            check,
+            timeout,
+            **kwargs,
+        )
+    except NonRetryableError:
+        # The source responded.
+        state.record(ok=True)
+        raise
+    except BaseException:
+        state.record(ok=False)
+        raise
+
+    # The source responded (also with e.g. 404: that's the business of the
+    # caller, the source is not down).
+    state.record(ok=True, latency=latency)
+    resp.raise_for_status()
+    return resp
+
+
+def _get_with_retries(
+    url,
+    source,
+    state,
+    attempts,
+    deadline,
+    backoff_seconds,
+    backoff_max_seconds,
+    hedge_percentile,
+    check,
+    timeout,
+    **kwargs,
+):
+    """
+    See `fetch()`. Return the response and the duration of the successful
+    attempt.
+    """
+    connect_timeout, read_timeout = timeout
+    for attempt in range(1, attempts + 1):
+        remaining = deadline - time.monotonic()
+        t0 = time.monotonic()
+        try:
+            attempt_timeout = (connect_timeout, max(0.1, min(read_timeout, remaining)))
+            hedge_delay = None
+            if hedge_percentile is not None:
+                hedge_delay = state.latency_percentile(hedge_percentile)
+            if hedge_delay is None:
+                resp = session().get(url, timeout=attempt_timeout, **kwargs)
+            else:
+                resp = _hedged_get(url, hedge_delay, timeout=attempt_timeout, **kwargs)
+            if _is_retryable_status(resp.status_code):
+                resp.raise_for_status()
+            if check is not None:
+                check(resp)
+        except NonRetryableError:
+            raise
+        except Exception as err:
+            remaining = deadline - time.monotonic()
+            if attempt == attempts or remaining <= 0:
+                log.info("%s: attempt %s failed, giving up: %s", source, attempt, err)
+                raise
+            wait_seconds = min(
+                remaining,
+                random.uniform(
+                    0, min(backoff_max_seconds, backoff_seconds * 2 ** (attempt - 1))
+                ),
+            )
+            log.info(
+                "%s: attempt %s failed: %s -- retry in %.2f s",
+                source,
+                attempt,
+                err,
+                wait_seconds,
+            )
+            time.sleep(wait_seconds)
+            continue
+
+        return resp, time.monotonic() - t0
+
+
+def _hedged_get(url, hedge_delay, **kwargs):
+    global _hedge_executor
+    with _sources_lock:
+        if _hedge_executor is None:
+            _hedge_executor = ThreadPoolExecutor(
+                max_workers=2 * POOL_HOSTS, thread_name_prefix="hedge"
+            )
+
+    first = _hedge_executor.submit(session().get, url, **kwargs)
+    done, _ = wait([first], timeout=hedge_delay)
+    if done:
+        return first.result()
+
+    log.info("no response after %.2f s, send hedged request: %s", hedge_delay, url)
+    second = _hedge_executor.submit(session().get, url, **kwargs)
+    pending = {first, second}
+    error = None
+    while pending:
+        done, pending = wait(pending, return_when=FIRST_COMPLETED)
+        for fut in done:
+            try:
+                return fut.result()
+            except Exception as err:
+                error = err
+    raise error
@@ -0,0 +1,320 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Offline load test for the GAE app (gae/main.py): boot it under uwsgi against
+local stand-ins for all upstream data sources (see `upstream_stub`) and for
+Firestore (see `benchapp`), drive mixed traffic, and report latency
+percentiles and throughput. For each uwsgi process/thread configuration.
+
+    python tools/bench/bench.py --configs 1x5,2x5 --duration 20
+
+Needs uwsgi (see gae/requirements.txt) and the app's dependencies, but no
+network access.
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import argparse
+import http.client
+import json
+import logging
+import multiprocessing
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, _bench_dir)
+
+import upstream_stub
+
+
+log = logging.getLogger()
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s.%(msecs)03d %(levelname)s: %(message)s",
+    datefmt="%y%m%d-%H:%M:%S",
+)
+
+
+def _traffic_mix():
+    """
+    Return list of (weight, endpoint class, function returning a path).
+    Roughly the production mix: mostly /now and per-state time series.
+    """
+    with open(os.path.join(upstream_stub.REPO_ROOT, "data.csv")) as f:
+        header = f.readline().strip().split(",")
+    states = sorted({c.split("_")[0] for c in header if c.startswith("DE-")})
+    with open(os.path.join(upstream_stub.REPO_ROOT, "ags.json")) as f:
+        # Skip AGSs w/o data (e.g. 3152, LK Göttingen (alt)): these are 404s.
+        agss = sorted(k for k, v in json.load(f).items() if "population" in v)
+    metrics = ["cases", "deaths"]
+
+    def ts():
+        return f"/timeseries/{random.choice(states)}/{random.choice(metrics)}"
+
+    return [
+        (30, "now", lambda: "/now"),
+        (30, "timeseries", ts),
+        (15, "timeseries-range", lambda: ts() + "?last=7"),
+        (
+            15,
+            "timeseries-ags",
+            lambda: f"/timeseries/ags/{random.choice(agss)}/{random.choice(metrics)}",
+        ),
+        (5, "timeseries-all", lambda: "/timeseries/all"),
+        (5, "7di", lambda: f"/7di/{random.choice(agss)}"),
+    ]
+
+
+def _request(port, path):
+    conn = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+    try:
+        conn.request("GET", path, headers={"Accept-Encoding": "gzip"})
+        resp = conn.getresponse()
+        resp.read()
+        return resp.status
+    finally:
+        conn.close()
+
+
+def _client_process(port, threads, duration_seconds, seed):
+    """
+    Run in a child process (the load generator should not be bottlenecked
+    by a single GIL). Return list of (endpoint class, latency seconds, ok).
+    """
+    random.seed(seed)
+    mix = _traffic_mix()
+    weights = [w for w, _, _ in mix]
+    results = []
+    deadline = time.time() + duration_seconds
+
+    def worker():
+        local = []
+        while time.time() < deadline:
+            _, eclass, pathfunc = random.choices(mix, weights)[0]
+            t0 = time.perf_counter()
+            try:
+                ok = _request(port, pathfunc()) < 400
+            except Exception:
+                ok = False
+            local.append((eclass, time.perf_counter() - t0, ok))
+        results.extend(local)
+
+    ts = [threading.Thread(target=worker) for _ in range(threads)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return results
+
+
+def _drive_load(port, concurrency, clients, duration_seconds):
+    threads_per_client = max(1, concurrency // clients)
+    with multiprocessing.Pool(clients) as pool:
+        chunks = pool.starmap(
+            _client_process,
+            [
+                (port, threads_per_client, duration_seconds, random.random())
+                for _ in range(clients)
+            ],
+        )
+    return [r for chunk in chunks for r in chunk]
+
+
+def _percentile(sorted_values, p):
+    # Nearest-rank method.
+    if not sorted_values:
+        return float("nan")
+    k = max(0, int(round(p / 100.0 * len(sorted_values) + 0.5)) - 1)
+    return sorted_values[min(k, len(sorted_values) - 1)]
+
+
+def _summarize(results, duration_seconds):
+    latencies = sorted(lat for _, lat, _ in results)
+    return {
+        "requests": len(results),
+        "errors": sum(1 for _, _, ok in results if not ok),
+        "rps": len(results) / duration_seconds,
+        "p50_ms": _percentile(latencies, 50) * 1000,
+        "p95_ms": _percentile(latencies, 95) * 1000,
+        "p99_ms": _percentile(latencies, 99) * 1000,
+    }
+
+
+def _free_port():
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def _wait_until_ready(port, proc, timeout_seconds=120):
+    deadline = time.time() + timeout_seconds
+    while time.time() < deadline:
+        if proc.poll() is not None:
+            raise Exception(f"uwsgi exited with code {proc.returncode}")
+        try:
+            # Also: have the first request fill the caches (app init).
+            if _request(port, "/now") == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise Exception("app did not become ready in time")
+
+
+def run_config(processes, threads, args, upstream_env):
+    port = _free_port()
+    workdir = tempfile.mkdtemp(prefix="covid19-bench-")
+    env = dict(os.environ)
+    env.update(upstream_env)
+    # Start w/o local cache snapshots from previous runs.
+    env["CACHE_SNAPSHOT_DIR"] = workdir
+    cmd = [
+        args.uwsgi,
+        "--http-socket",
+        f"127.0.0.1:{port}",
+        "--wsgi-file",
+        os.path.join(_bench_dir, "benchapp.py"),
+        "--callable",
+        "app",
+        "--master",
+        "--processes",
+        str(processes),
+        "--threads",
+        str(threads),
+        "--disable-logging",
+        "--die-on-term",
+    ]
+    logpath = os.path.join(workdir, "uwsgi.log")
+    log.info(
+        "start app: %s processes, %s threads (log: %s)", processes, threads, logpath
+    )
+    with open(logpath, "wb") as logfile:
+        proc = subprocess.Popen(cmd, env=env, stdout=logfile, stderr=subprocess.STDOUT)
+    try:
+        _wait_until_ready(port, proc)
+        if args.warmup > 0:
+            log.info("warm up for %s s", args.warmup)
+            _drive_load(port, args.concurrency, args.clients, args.warmup)
+        log.info("measure for %s s, concurrency %s", args.duration, args.concurrency)
+        results = _drive_load(port, args.concurrency, args.clients, args.duration)
+    finally:
+        proc.terminate()
+        proc.wait(timeout=30)
+
+    summary = _summarize(results, args.duration)
+    summary["config"] = f"{processes}x{threads}"
+    summary["endpoints"] = {
+        eclass: _summarize([r for r in results if r[0] == eclass], args.duration)
+        for eclass in sorted({r[0] for r in results})
+    }
+    if not args.keep_workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return summary
+
+
+def _print_table(rows, title):
+    fmt = "{:<18} {:>9} {:>7} {:>9} {:>9} {:>9} {:>9}"
+    print(fmt.format(title, "requests", "errors", "rps", "p50/ms", "p95/ms", "p99/ms"))
+    for key, s in rows:
+        print(
+            fmt.format(
+                key,
+                s["requests"],
+                s["errors"],
+                "%.1f" % s["rps"],
+                "%.2f" % s["p50_ms"],
+                "%.2f" % s["p95_ms"],
+                "%.2f" % s["p99_ms"],
+            )
+        )
+
+
+def main():
+
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument(
+        "--configs",
+        default="1x5,1x10,2x5",
+        help="uwsgi configurations: comma-separated list of PROCESSESxTHREADS "
+        "(default: %(default)s; production: 1x5)",
+    )
+    parser.add_argument("--duration", type=float, default=20, help="seconds")
+    parser.add_argument("--warmup", type=float, default=3, help="seconds")
+    parser.add_argument(
+        "--concurrency", type=int, default=20, help="concurrent client connections"
+    )
+    parser.add_argument(
+        "--clients", type=int, default=4, help="load generator processes"
+    )
+    parser.add_argument(
+        "--upstream-latency",
+        type=float,
+        default=0.05,
+        help="delay (seconds) of each upstream stub response",
+    )
+    parser.add_argument("--uwsgi", default=shutil.which("uwsgi") or "uwsgi")
+    parser.add_argument("--per-endpoint", action="store_true")
+    parser.add_argument("--json", metavar="PATH", help="also write results to file")
+    parser.add_argument("--keep-workdir", action="store_true")
+    args = parser.parse_args()
+
+    configs = []
+    for c in args.configs.split(","):
+        processes, threads = c.lower().split("x")
+        configs.append((int(processes), int(threads)))
+
+    server, base_url = upstream_stub.start(latency_seconds=args.upstream_latency)
+    summaries = []
+    try:
+        for processes, threads in configs:
+            summaries.append(
+                run_config(
+                    processes, threads, args, upstream_stub.app_environment(base_url)
+                )
+            )
+    finally:
+        server.shutdown()
+
+    print()
+    _print_table([(s["config"], s) for s in summaries], "uwsgi PxT")
+    if args.per_endpoint:
+        for s in summaries:
+            print()
+            _print_table(sorted(s["endpoints"].items()), s["config"])
+
+    if args.json:
+        with open(args.json, "w") as f:
+            json.dump(summaries, f, indent=2)
+        log.info("wrote %s", args.json)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+WSGI entry point for benchmarking the GAE app (gae/main.py) w/o Google Cloud:
+use the in-memory backup store instead of Firestore.
+
+    uwsgi --wsgi-file tools/bench/benchapp.py --callable app ...
+
+The upstream data source URLs are expected in the environment (see
+`upstream_stub.app_environment()`).
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import os
+import sys
+
+
+_bench_dir = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(_bench_dir, "..", "..", "gae"))
+
+# Keep cache backups in process memory, instead of in Firestore.
+os.environ.setdefault("BACKUP_STORE", "memory")
+
+import main  # noqa: E402
+
+app = main.app
@@ -0,0 +1,154 @@
+# MIT License
+
+# Copyright (c) 2020 Dr. Jan-Philip Gehrcke
+
+# Permission is hereby granted, free of charge, to any person obtaining a copy
+# of this software and associated documentation files (the "Software"), to deal
+# in the Software without restriction, including without limitation the rights
+# to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+# copies of the Software, and to permit persons to whom the Software is
+# furnished to do so, subject to the following conditions:
+
+# The above copyright notice and this permission notice shall be included in all
+# copies or substantial portions of the Software.
+
+# THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+# IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+# FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+# AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+# LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+# OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN THE
+# SOFTWARE.
+
+"""
+Local stand-in for the upstream data sources of the GAE app: replay ZEIT
+ONLINE, Berliner Morgenpost, Risklayer and GitHub (raw file) payloads over
+HTTP, w/o network access.
+
+    /zeit.json      ZEIT ONLINE JSON document (ZEIT_JSON_URL)
+    /mopo.csv       Berliner Morgenpost CSV document (BE_MOPO_CSV_URL)
+    /rl.csv         Risklayer CSV document (RL_TS_CSV_URL)
+    /repo/<path>    file <path> of this repository (DATA_REPO_RAW_URL)
+
+Repository files are served with an ETag, and conditional requests are
+answered with 304, like GitHub does.
+
+This module is part of https://github.com/jgehrcke/covid-19-germany-gae
+"""
+
+import hashlib
+import json
+import logging
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+log = logging.getLogger(__name__)
+
+REPO_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "..")
+
+# Files the app reads from the repository.
+REPO_FILES = (
+    "data.csv",
+    "cases-rki-by-ags.csv",
+    "deaths-rki-by-ags.csv",
+    "more-data/7di-rki-by-ags.csv",
+)
+
+ZEIT_JSON = json.dumps(
+    {
+        "currentStats": {"count": 2233000, "dead": 60000, "recovered": 1900000},
+        "lastUpdate": "2021-02-01T10:00:00+0100",
+    }
+).encode("utf-8")
+
+MOPO_CSV = b"""\
+label,parent,confirmed,deaths,recovered,date
+Bayern,Deutschland,420000,11000,380000,2021-02-01 09:00
+Berlin,Deutschland,122000,2400,110000,2021-02-01 09:00
+Hamburg,Deutschland,48000,1100,43000,2021-02-01 09:00
+"""
+
+RL_CSV = b"""\
+AGS,current
+1001,3100
+1002,9000
+11000,122500
+"""
+
+
+def _load_payloads():
+    payloads = {
+        "/zeit.json": ("application/json", ZEIT_JSON),
+        "/mopo.csv": ("text/csv", MOPO_CSV),
+        "/rl.csv": ("text/csv", RL_CSV),
+    }
+    for path in REPO_FILES:
+        with open(os.path.join(REPO_ROOT, path), "rb") as f:
+            payloads[f"/repo/{path}"] = ("text/plain; charset=utf-8", f.read())
+    return payloads
+
+
+class _Handler(BaseHTTPRequestHandler):
+
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        # Ignore query parameters (the app appends cache busters).
+        path = self.path.split("?")[0]
+        entry = self.server.payloads.get(path)
+        if self.server.latency_seconds:
+            time.sleep(self.server.latency_seconds)
+        if entry is None:
+            self._respond(404, "text/plain", b"not found\n")
+            return
+
+        content_type, body = entry
+        etag = '"%s"' % hashlib.sha1(body).hexdigest()
+        if path.startswith("/repo/") and self.headers.get("If-None-Match") == etag:
+            self._respond(304, None, b"", etag)
+            return
+        self._respond(200, content_type, body, etag)
+
+    def _respond(self, status, content_type, body, etag=None):
+        self.send_response(status)
+        if content_type is not None:
+            self.send_header("Content-Type", content_type)
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, fmt, *args):
+        log.debug("upstream stub: " + fmt, *args)
+
+
+def start(latency_seconds=0.0, port=0):
+    """
+    Serve in a background thread, on 127.0.0.1. `latency_seconds`: delay
+    each response (emulate a remote server). Return (server, base URL).
+    """
+    server = ThreadingHTTPServer(("127.0.0.1", port), _Handler)
+    server.daemon_threads = True
+    server.payloads = _load_payloads()
+    server.latency_seconds = latency_seconds
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    base_url = "http://127.0.0.1:%s" % server.server_address[1]
+    log.info("upstream stub serving at %s", base_url)
+    return server, base_url
+
+
+def app_environment(base_url):
+    """
+    Return the environment variables pointing the app to the stub at
+    `base_url`.
+    """
+    return {
+        "ZEIT_JSON_URL": f"{base_url}/zeit.json",
+        "BE_MOPO_CSV_URL": f"{base_url}/mopo.csv",
+        "RL_TS_CSV_URL": f"{base_url}/rl.csv",
+        "DATA_REPO_RAW_URL": f"{base_url}/repo",
+    }
@@ -27,14 +27,12 @@ This program is part of https://github.com/jgehrcke/covid-19-germany-gae
 import os
 import json
 import sys
-import time
 import pytz
 import urllib.parse
 from datetime import datetime, timedelta
 from itertools import zip_longest
 
 import pandas as pd
-import requests
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 
@@ -260,6 +258,41 @@ def chunks(iterable, n, fillvalue=None):
     return zip_longest(*args, fillvalue=fillvalue)
 
 
+def fetch_arcgis_features(url, attempts):
+    """
+    Query the ArcGIS system, return the parsed response (containing
+    `features`). Retry upon request errors and upon unexpected data (the
+    system occasionally responds with an error object, with status code 200).
+    Exit the program if all attempts failed.
+    """
+
+    def _check(resp):
+        data = resp.json()
+        if "features" not in data:
+            raise Exception(f"unexpected data:\n{json.dumps(data, indent=2)}")
+
+    try:
+        resp = lib.upstream.fetch(
+            url,
+            source="arcgis",
+            attempts=attempts,
+            budget_seconds=attempts * 120,
+            backoff_seconds=5,
+            backoff_max_seconds=60,
+            check=_check,
+            timeout=(3.05, 75),
+            headers={
+                "user-agent": "Mozilla/5.0 (X11; Fedora; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
+            },
+        )
+    except Exception as err:
+        log.info("giving up: %s", err)
+        sys.exit("too many attempts, stop retrying")
+
+    log.info("response looks good")
+    return resp.json()
+
+
 def fetch_lks():
     """
     Conduct a synthetic query towards getting the set of Landkreise w/o being
@@ -284,41 +317,7 @@ def fetch_lks():
 
     log.info("Query for set of LKs, with parameters: %s", paramdict)
 
-    attempt = 0
-    while True:
-        attempt += 1
-
-        if attempt >= 7:
-            sys.exit("too many attempts, stop retrying")
-
-        try:
-            resp = resp = requests.get(
-                url,
-                timeout=(3.05, 75),
-                headers={
-                    "user-agent": "Mozilla/5.0 (X11; Fedora; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
-                },
-            )
-            resp.raise_for_status()
-        except requests.exceptions.RequestException as err:
-            log.info("request error (attempt %s): %s", attempt, err)
-            log.info("retry soon")
-            time.sleep(15)
-            continue
-
-        log.info("Got OK response, parse through data")
-
-        data = resp.json()
-        if "features" in data:
-            log.info("response looks good")
-            break
-
-        log.info(
-            "unexpected data (attempt %s) -- retry soon:\n%s",
-            attempt,
-            json.dumps(data, indent=2),
-        )
-        time.sleep(15)
+    data = fetch_arcgis_features(url, attempts=6)
 
     objs = [o["attributes"] for o in data["features"]]
 
@@ -385,41 +384,7 @@ def fetch_history_for_many_ags(ags_list):
 
     log.info("Query for history for these AGSs: %s", ags_list)
     log.info("query params:%s", json.dumps(paramdict, indent=2))
-    attempt = 0
-    while True:
-        attempt += 1
-
-        if attempt >= 10:
-            sys.exit("too many attempts, stop retrying")
-
-        try:
-            resp = requests.get(
-                url,
-                headers={
-                    "user-agent": "Mozilla/5.0 (X11; Fedora; Linux x86_64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/87.0.4280.88 Safari/537.36",
-                },
-                timeout=(3.05, 75),
-            )
-            resp.raise_for_status()
-        except requests.exceptions.RequestException as err:
-            log.info("request error (attempt %s): %s", attempt, err)
-            log.info("retry soon")
-            time.sleep(15)
-            continue
-
-        log.info("Got OK response, parse through data")
-
-        data = resp.json()
-        if "features" in data:
-            log.info("response looks good")
-            break
-
-        log.info(
-            "unexpected data (attempt %s) -- retry soon:\n%s",
-            attempt,
-            json.dumps(data, indent=2),
-        )
-        time.sleep(15)
+    data = fetch_arcgis_features(url, attempts=9)
 
     # print(json.dumps(data, indent=2))
 
@@ -31,7 +31,6 @@ import pytz
 from datetime import datetime, timedelta
 
 import pandas as pd
-import requests
 
 sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
 import lib
@@ -96,7 +95,10 @@ def aggregate_by_bland(df_by_lk):
 def fetch_and_clean_data(evarname):
     log.info("fetch RL/TS/CS data from gsheets")
     # risklayer history as CSV from google sheets
-    csv = requests.get(os.environ[evarname]).text
+    resp = lib.upstream.fetch(
+        os.environ[evarname], source="gsheets", timeout=(3.05, 60), budget_seconds=300
+    )
+    csv = resp.text
     df = pd.read_csv(io.StringIO(csv))
 
     print(df)